@@ -1,11 +1,67 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, g, jsonify,
+                   Response, stream_with_context, has_request_context, abort,
+                   before_render_template, template_rendered)
 from datetime import datetime, timedelta
-from functools import wraps
-import sqlite3, os
+from functools import wraps, lru_cache
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+import sqlite3, os, queue, threading, csv, io, json, pickle, time, re, tempfile, urllib.parse, gzip, hashlib, secrets, socket
+from markupsafe import Markup, escape
+import click
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask.sessions import SecureCookieSessionInterface
 from werkzeug.security import generate_password_hash, check_password_hash
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"  # Change this for production
+app.config.update(
+    DATABASE="time_manager.db",
+    DB_POOL_SIZE=8,              # max open connections shared by all request threads
+    DB_POOL_TIMEOUT=10,          # seconds to wait for a free connection
+    DB_BUSY_TIMEOUT_MS=5000,     # how long SQLite waits on a locked database
+    DB_SYNCHRONOUS="NORMAL",     # NORMAL is safe in WAL mode and much faster than FULL
+    DB_CACHE_SIZE_KB=16384,      # page cache per connection
+    DASHBOARD_WEEKS=4,           # previous weeks rendered on the dashboard besides the current one
+    EXPORT_BATCH_SIZE=1000,      # rows fetched from the cursor per streamed chunk
+    IMPORT_CHUNK_SIZE=5000,      # rows inserted per transaction by bulk imports
+    IMPORT_MAX_REPORTED_ERRORS=1000,
+    REPORT_CACHE_BACKEND="local",  # "local" (in-process LRU) or "shared" (Redis-compatible)
+    REPORT_CACHE_MAX_ENTRIES=1024,
+    REPORT_CACHE_REDIS_URL="redis://localhost:6379/0",
+    REPORT_CACHE_TTL=3600,       # seconds, shared backend only
+    SEARCH_PAGE_SIZE=20,         # diary search results per page
+    TEAM_PAGE_SIZE=50,           # users per page on the admin team overview
+    SLOW_REQUEST_MS=None,        # log requests slower than this, with their queries
+    METRICS_TOKEN=None,          # bearer token that lets a scraper read /metrics without an admin login
+    ARCHIVE_DIR="archive",       # where archive-year writes its per-year time_manager_YYYY.db files
+    JOB_WORKERS=2,               # threads running background jobs
+    JOB_BATCH_SIZE=500,          # rows a background job deletes or updates per transaction
+    JOB_BATCH_PAUSE_MS=10,       # pause between batches so interactive writes get the lock
+    JOB_UPLOAD_DIR=None,         # where queued imports are staged (default: the system temp dir)
+    JOBS_EAGER=False,            # run jobs in the enqueuing thread instead (check-query-plans, debugging)
+    JOB_LEASE_SECONDS=120,       # a job whose process stops renewing its lease this long is taken over
+    SWEEP_STALE_AFTER_MINUTES=960,  # open sessions older than this count as forgotten
+    SWEEP_POLICY="baseline",     # how forgotten sessions are closed: baseline, check_in or end_of_day
+    SWEEP_INTERVAL_SECONDS=None,  # also sweep in-process this often (None: use `flask sweep-sessions`)
+    PASSWORD_HASH_METHOD="scrypt",  # Werkzeug method and cost, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+    PASSWORD_HASH_WORKERS=2,     # threads that hash passwords, capping the CPU logins can take
+    PASSWORD_HASH_MAX_PENDING=16,  # hashes running or queued before logins get 503
+    PASSWORD_HASH_TIMEOUT=10,    # seconds a request waits for its hash
+    API_GZIP_MIN_BYTES=1024,     # gzip /api/v1 responses at least this large
+    LOGIN_SESSION_TTL_HOURS=168,       # a login lasts a week
+    LOGIN_SESSION_CACHE_SIZE=10000,    # sessions kept in the in-process LRU
+    LOGIN_SESSION_CACHE_SECONDS=30,    # re-read a cached session after this long
+    LOGIN_SESSION_PURGE_SECONDS=3600,  # delete expired sessions this often (None disables)
+    WORKDAY_BASELINE_MINUTES=480,      # expected minutes on a workday; weekends and holidays expect none
+    HOLIDAYS=(),                       # "YYYY-MM-DD" dates, or "MM-DD" for every year
+)
+# TIME_MANAGER_* environment variables (TIME_MANAGER_SECRET_KEY, TIME_MANAGER_DATABASE,
+# TIME_MANAGER_DB_POOL_SIZE=16, ...; values are parsed as JSON where possible) override the
+# defaults above. Loading them at import gives `flask --app app ...` commands the same settings
+# as the server.
+app.config.from_prefixed_env("TIME_MANAGER")
 
 # ---------------------------
 # Login Required Decorator
@@ -19,11 +75,291 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# ---------------------------
+# Instrumentation
+# ---------------------------
+class Histogram:
+    """A Prometheus-style cumulative histogram, optionally split by one label."""
+    def __init__(self, name, help_text, buckets, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items(), key=lambda item: str(item[0])):
+                labels = f'{self.label}="{label_value}",' if self.label else ""
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {series["count"]}')
+                suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+                lines.append(f"{self.name}_sum{suffix} {series['sum']}")
+                lines.append(f"{self.name}_count{suffix} {series['count']}")
+        return lines
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+METRICS = {
+    "request": Histogram("tm_request_duration_seconds", "Request latency by endpoint.", LATENCY_BUCKETS, "endpoint"),
+    "queries": Histogram("tm_request_queries", "SQL statements issued per request, by endpoint.",
+                         QUERY_COUNT_BUCKETS, "endpoint"),
+    "sql": Histogram("tm_request_sql_seconds", "Time spent in SQLite per request, by endpoint.",
+                     LATENCY_BUCKETS, "endpoint"),
+    "flex": Histogram("tm_flex_calculation_seconds", "Time spent in calculate_daily_and_weekly_flex.",
+                      LATENCY_BUCKETS),
+    "render": Histogram("tm_template_render_seconds", "Template rendering time by template.",
+                        LATENCY_BUCKETS, "template"),
+    "job": Histogram("tm_job_duration_seconds", "Background job run time by kind.", JOB_BUCKETS, "kind"),
+    "password_hash": Histogram("tm_password_hash_seconds",
+                               "Password hashing time including the wait for a hashing thread, by operation.",
+                               LATENCY_BUCKETS, "operation"),
+}
+
+def _record_sql(sql, seconds, count=True):
+    """Adds a statement (or extra fetch time for the last one) to the current request's query log."""
+    if not has_request_context() or "query_log" not in g:
+        return
+    g.sql_seconds += seconds
+    if count:
+        g.query_log.append((" ".join(str(sql).split()), seconds))
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that reports each statement and the time spent executing and fetching it."""
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_sql(None, time.perf_counter() - started, count=False)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _record_sql(None, time.perf_counter() - started, count=False)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_sql(None, time.perf_counter() - started, count=False)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Hands out InstrumentedCursors, including for the connection-level shortcuts."""
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def timed(metric):
+    """Decorator recording a function's run time in METRICS[metric]."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                METRICS[metric].observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.query_log = []
+    g.sql_seconds = 0.0
+
+@app.after_request
+def record_request_metrics(response):
+    if "request_started" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or "unmatched"
+    METRICS["request"].observe(elapsed, endpoint)
+    METRICS["queries"].observe(len(g.query_log), endpoint)
+    METRICS["sql"].observe(g.sql_seconds, endpoint)
+    slow_ms = app.config["SLOW_REQUEST_MS"]
+    if slow_ms is not None and elapsed * 1000 >= slow_ms:
+        queries = "\n".join(f"  {seconds * 1000:7.2f} ms  {sql}" for sql, seconds in g.query_log)
+        app.logger.warning("Slow request %s %s -> %s in %.1f ms (%d queries, %.1f ms SQL)\n%s",
+                           request.method, request.path, response.status_code, elapsed * 1000,
+                           len(g.query_log), g.sql_seconds * 1000, queries)
+    return response
+
+@before_render_template.connect_via(app)
+def _start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _record_render_time(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        METRICS["render"].observe(time.perf_counter() - started, template.name)
+
+# ---------------------------
+# Database Connection Pool
+# ---------------------------
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections opened in WAL mode.
+    Connections are created lazily up to `size` and handed out one at a time;
+    when all are busy, callers wait up to `timeout` seconds for one to be released.
+    """
+    def __init__(self, path, size, timeout, busy_timeout_ms, synchronous, cache_size_kb):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # uri=True lets exports ATTACH archive files read-only with file:...?mode=ro.
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, uri=True,
+                               check_same_thread=False, factory=InstrumentedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA foreign_keys=OFF")
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("database connection pool exhausted")
+
+    def release(self, conn):
+        # Never hand a connection with a half-finished transaction to the next request.
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the process-wide pool, (re)creating it if the database config changed."""
+    global _pool
+    cfg = app.config
+    with _pool_lock:
+        if _pool is None or _pool.path != cfg["DATABASE"]:
+            if _pool is not None:
+                _pool.close_all()
+            _pool = ConnectionPool(cfg["DATABASE"], cfg["DB_POOL_SIZE"], cfg["DB_POOL_TIMEOUT"],
+                                   cfg["DB_BUSY_TIMEOUT_MS"], cfg["DB_SYNCHRONOUS"],
+                                   cfg["DB_CACHE_SIZE_KB"])
+        return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+@contextmanager
+def db_connection():
+    """Borrows a pooled connection outside of a request (startup, CLI commands)."""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+def get_db():
+    """Returns the connection bound to the current request, taking one from the pool on first use."""
+    if "db" not in g:
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop("db", None)
+    if conn is not None:
+        g.pop("db_pool").release(conn)
+
 # ---------------------------
 # Database Initialization
 # ---------------------------
 def init_db():
-    conn = sqlite3.connect("time_manager.db")
+    """
+    Creates the schema, applies pending migrations and seeds the admin account. Safe when
+    several processes start at once: each step runs under BEGIN IMMEDIATE, so the first does
+    the work and the rest find it done.
+    """
+    with db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _create_schema(conn)
+        migrate_db(conn)
+        _ensure_admin(conn)
+
+def _create_schema(conn):
     c = conn.cursor()
     # Create users table.
     c.execute('''CREATE TABLE IF NOT EXISTS users (
@@ -31,11 +367,6 @@ def init_db():
                     username TEXT UNIQUE,
                     password TEXT
                  )''')
-    # Ensure an admin account exists.
-    c.execute("SELECT id FROM users WHERE username = ?", ("admin",))
-    if not c.fetchone():
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", 
-                  ("admin", generate_password_hash("Inova20!0")))
     # Create time_logs table with user_id.
     c.execute('''CREATE TABLE IF NOT EXISTS time_logs (
                     id INTEGER PRIMARY KEY, 
@@ -56,32 +387,427 @@ def init_db():
                     FOREIGN KEY(time_log_id) REFERENCES time_logs(id)
                  )''')
     conn.commit()
-    conn.close()
+
+# ---------------------------
+# Schema Migrations
+# ---------------------------
+# Each migration is (version, description, steps) and is applied exactly once, in order.
+# A step is either an SQL string or a callable taking a cursor, for data backfills.
+# REBUILD_ROLLUPS asks for the flex rollups to be rebuilt once all pending migrations
+# have run, so the rebuild always sees the final schema.
+REBUILD_ROLLUPS = "rebuild rollups"
+
+MIGRATIONS = [
+    (1, "Index time_logs and diary for per-user lookups", [
+        # Covers every time_logs column, so per-user listings never touch the table itself.
+        "CREATE INDEX IF NOT EXISTS idx_time_logs_user_date "
+        "ON time_logs (user_id, date, check_in, check_out, flex_time)",
+        "CREATE INDEX IF NOT EXISTS idx_time_logs_open "
+        "ON time_logs (user_id, date) WHERE check_out IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_diary_user_timestamp ON diary (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_diary_time_log ON diary (time_log_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_diary_active "
+        "ON diary (user_id, time_log_id) WHERE end_time IS NULL",
+    ]),
+    (2, "Add daily and weekly flex rollup tables", [
+        '''CREATE TABLE IF NOT EXISTS daily_summary (
+               user_id INTEGER,
+               date TEXT,
+               minutes REAL,
+               sessions INTEGER,
+               PRIMARY KEY (user_id, date)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS weekly_summary (
+               user_id INTEGER,
+               iso_year INTEGER,
+               iso_week INTEGER,
+               minutes REAL,
+               days INTEGER,
+               PRIMARY KEY (user_id, iso_year, iso_week)
+           ) WITHOUT ROWID''',
+        REBUILD_ROLLUPS,
+    ]),
+    (3, "Add idempotency keys for bulk-imported time logs", [
+        "ALTER TABLE time_logs ADD COLUMN import_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_time_logs_import_key "
+        "ON time_logs (user_id, import_key) WHERE import_key IS NOT NULL",
+    ]),
+    (4, "Add a per-user data version for report cache invalidation", [
+        "ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (5, "Add full-text search over diary notes", [
+        lambda c: _create_diary_fts(c),
+    ]),
+    (6, "Add per-user flex totals for the team overview", [
+        '''CREATE TABLE IF NOT EXISTS user_totals (
+               user_id INTEGER PRIMARY KEY,
+               minutes REAL,
+               days INTEGER,
+               flex REAL
+           )''',
+        "CREATE INDEX IF NOT EXISTS idx_user_totals_flex ON user_totals (flex)",
+        REBUILD_ROLLUPS,
+    ]),
+    (7, "Store sessions as integer epoch minutes with their ISO year and week", [
+        "ALTER TABLE time_logs ADD COLUMN start_min INTEGER",
+        "ALTER TABLE time_logs ADD COLUMN end_min INTEGER",
+        "ALTER TABLE time_logs ADD COLUMN iso_year INTEGER",
+        "ALTER TABLE time_logs ADD COLUMN iso_week INTEGER",
+        lambda c: _backfill_session_columns(c),
+        "DROP INDEX IF EXISTS idx_time_logs_user_date",
+        "CREATE INDEX IF NOT EXISTS idx_time_logs_user_date "
+        "ON time_logs (user_id, date, check_in, check_out, flex_time, iso_week)",
+        "CREATE INDEX IF NOT EXISTS idx_time_logs_user_week "
+        "ON time_logs (user_id, iso_year, iso_week, start_min, end_min)",
+        "CREATE INDEX IF NOT EXISTS idx_time_logs_user_start ON time_logs (user_id, start_min, end_min)",
+        REBUILD_ROLLUPS,
+    ]),
+    (8, "Track archived years and the flex they carry over", [
+        '''CREATE TABLE IF NOT EXISTS archived_years (
+               year INTEGER PRIMARY KEY,
+               path TEXT NOT NULL,
+               time_logs INTEGER NOT NULL,
+               diary INTEGER NOT NULL,
+               archived_at TEXT
+           )''',
+        '''CREATE TABLE IF NOT EXISTS flex_carryover (
+               user_id INTEGER NOT NULL,
+               year INTEGER NOT NULL,
+               minutes INTEGER NOT NULL,
+               days INTEGER NOT NULL,
+               flex INTEGER NOT NULL,
+               PRIMARY KEY (user_id, year)
+           ) WITHOUT ROWID''',
+    ]),
+    (9, "Add the background job table", [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+               id INTEGER PRIMARY KEY,
+               kind TEXT NOT NULL,
+               params TEXT,
+               status TEXT NOT NULL,
+               progress INTEGER NOT NULL DEFAULT 0,
+               total INTEGER,
+               result TEXT,
+               error TEXT,
+               created_by INTEGER,
+               created_at TEXT,
+               started_at TEXT,
+               finished_at TEXT
+           )''',
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)",
+    ]),
+    (10, "Index open sessions and diary entries for the sweeper", [
+        "CREATE INDEX IF NOT EXISTS idx_time_logs_stale ON time_logs (start_min) WHERE check_out IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_diary_open ON diary (end_time, time_log_id) WHERE end_time IS NULL",
+    ]),
+    (11, "Index diary entries by session for activity analytics", [
+        # Covering, so the analytics pass reads entries in session order without touching the table.
+        "CREATE INDEX IF NOT EXISTS idx_diary_user_log "
+        "ON diary (user_id, time_log_id, timestamp, end_time, note)",
+    ]),
+    (12, "Add server-side login sessions", [
+        '''CREATE TABLE IF NOT EXISTS login_sessions (
+               id TEXT PRIMARY KEY,
+               user_id INTEGER NOT NULL,
+               username TEXT NOT NULL,
+               role TEXT NOT NULL,
+               created_at INTEGER NOT NULL,
+               expires_at INTEGER NOT NULL
+           ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_login_sessions_user ON login_sessions (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_login_sessions_expires ON login_sessions (expires_at)",
+    ]),
+    (13, "Add the calendar table and per-day flex baselines", [
+        '''CREATE TABLE IF NOT EXISTS calendar (
+               date TEXT PRIMARY KEY,
+               iso_year INTEGER NOT NULL,
+               iso_week INTEGER NOT NULL,
+               month TEXT NOT NULL,
+               weekday INTEGER NOT NULL,
+               is_workday INTEGER NOT NULL,
+               is_holiday INTEGER NOT NULL,
+               baseline_minutes INTEGER NOT NULL
+           ) WITHOUT ROWID''',
+        "ALTER TABLE weekly_summary ADD COLUMN baseline INTEGER NOT NULL DEFAULT 0",
+        lambda c: ensure_calendar(c, _data_years(c, "time_logs") + [datetime.now().year, datetime.now().year + 1]),
+        REBUILD_ROLLUPS,
+    ]),
+    (14, "Index the diary owner in diary_fts so searches stay within one user", [
+        "DROP TRIGGER IF EXISTS diary_fts_insert",
+        "DROP TRIGGER IF EXISTS diary_fts_delete",
+        "DROP TRIGGER IF EXISTS diary_fts_update",
+        "DROP TABLE IF EXISTS diary_fts",
+        lambda c: _create_diary_fts(c),
+    ]),
+    (15, "Store the admin role on the account instead of deriving it from the username", [
+        "ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0",
+        "UPDATE users SET is_admin = 1 WHERE username = 'admin'",
+        "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)",
+        # Sessions that got the admin role from a look-alike username such as "Admin".
+        "DELETE FROM login_sessions WHERE role = 'admin' AND user_id NOT IN (SELECT id FROM users WHERE is_admin = 1)",
+    ]),
+    (16, "Drop the time_logs ISO week columns and the indexes no query reads", [
+        # Weeks come from the calendar table; nothing reads these, and each index slowed every write.
+        "DROP INDEX IF EXISTS idx_time_logs_user_week",
+        "DROP INDEX IF EXISTS idx_time_logs_user_start",
+        "DROP INDEX IF EXISTS idx_time_logs_user_date",
+        "CREATE INDEX IF NOT EXISTS idx_time_logs_user_date "
+        "ON time_logs (user_id, date, check_in, check_out, flex_time)",
+        "ALTER TABLE time_logs DROP COLUMN iso_year",
+        "ALTER TABLE time_logs DROP COLUMN iso_week",
+    ]),
+    (17, "Never hand out a deleted user's id again", [
+        # AUTOINCREMENT keeps the highest id ever used, so archived rows never reach a new account.
+        '''CREATE TABLE users_new (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               username TEXT UNIQUE,
+               password TEXT,
+               data_version INTEGER NOT NULL DEFAULT 0,
+               is_admin INTEGER NOT NULL DEFAULT 0
+           )''',
+        "INSERT INTO users_new (id, username, password, data_version, is_admin) "
+        "SELECT id, username, password, data_version, is_admin FROM users",
+        "DROP TABLE users",
+        "ALTER TABLE users_new RENAME TO users",
+        "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)",
+        lambda c: _retire_user_ids(c),
+    ]),
+    (18, "Record which process owns each job and when it last renewed its lease", [
+        "ALTER TABLE jobs ADD COLUMN owner TEXT",
+        "ALTER TABLE jobs ADD COLUMN heartbeat_at INTEGER",
+    ]),
+]
+
+def _retire_user_ids(c):
+    """
+    Starts new user ids above every id that still owns rows, including accounts deleted
+    before ids were retired whose sessions remain in an archive file.
+    """
+    c.execute("""
+        SELECT MAX(COALESCE((SELECT MAX(id) FROM users), 0),
+                   COALESCE((SELECT MAX(user_id) FROM time_logs), 0),
+                   COALESCE((SELECT MAX(user_id) FROM diary), 0),
+                   COALESCE((SELECT MAX(user_id) FROM flex_carryover), 0))
+    """)
+    top = c.fetchone()[0]
+    c.execute("SELECT path FROM archived_years")
+    for (path,) in c.fetchall():
+        if not os.path.exists(path):
+            continue
+        # A separate read-only connection, since an attached file cannot be detached mid-migration.
+        archive = sqlite3.connect("file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro", uri=True)
+        try:
+            top = max(top, archive.execute("SELECT COALESCE(MAX(user_id), 0) FROM time_logs").fetchone()[0])
+        finally:
+            archive.close()
+    c.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'users'", (top,))
+    if not c.rowcount:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('users', ?)", (top,))
+
+def _backfill_session_columns(c):
+    c.execute("SELECT id, date, check_in, check_out FROM time_logs")
+    rows = [session_columns(date, check_in, check_out) + (log_id,)
+            for log_id, date, check_in, check_out in c.fetchall()]
+    c.executemany("UPDATE time_logs SET start_min=?, end_min=? WHERE id=?", rows)
+
+def _create_diary_fts(c):
+    """
+    Creates diary_fts, an external-content FTS5 index over diary.note, kept in sync by triggers
+    so every insert, edit and delete path is covered. Each row also indexes its owner as a
+    "u<user_id>" token in the uid column, so searches match inside one user's notes instead of
+    ranking every user's matches and filtering afterwards. Skipped when SQLite lacks FTS5;
+    /diary/search then falls back to LIKE.
+    """
+    c.execute("CREATE VIEW IF NOT EXISTS diary_fts_source AS "
+              "SELECT id, note, 'u' || user_id AS uid FROM diary")
+    try:
+        c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS diary_fts USING fts5(note, uid, "
+                  "content='diary_fts_source', content_rowid='id', tokenize='unicode61')")
+    except sqlite3.OperationalError:
+        return
+    c.execute('''CREATE TRIGGER IF NOT EXISTS diary_fts_insert AFTER INSERT ON diary BEGIN
+                     INSERT INTO diary_fts (rowid, note, uid) VALUES (new.id, new.note, 'u' || new.user_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS diary_fts_delete AFTER DELETE ON diary BEGIN
+                     INSERT INTO diary_fts (diary_fts, rowid, note, uid)
+                     VALUES ('delete', old.id, old.note, 'u' || old.user_id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS diary_fts_update AFTER UPDATE OF note, user_id ON diary BEGIN
+                     INSERT INTO diary_fts (diary_fts, rowid, note, uid)
+                     VALUES ('delete', old.id, old.note, 'u' || old.user_id);
+                     INSERT INTO diary_fts (rowid, note, uid) VALUES (new.id, new.note, 'u' || new.user_id);
+                 END''')
+    c.execute("INSERT INTO diary_fts (diary_fts) VALUES ('rebuild')")
+
+def _ensure_admin(conn):
+    """Creates the admin account if it does not exist. Runs after migrations, which add users.is_admin."""
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT id FROM users WHERE username = ?", ("admin",))
+    if not c.fetchone():
+        c.execute("INSERT INTO users (username, password, is_admin) VALUES (?, ?, 1)",
+                  ("admin", generate_password_hash("Inova20!0", method=app.config["PASSWORD_HASH_METHOD"])))
+    conn.commit()
+
+def migrate_db(conn):
+    """
+    Brings an existing database up to the latest schema version in place.
+    Runs under BEGIN IMMEDIATE so concurrent starters apply each migration only once.
+    Returns the list of versions that were applied.
+    """
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TEXT
+                 )''')
+    conn.commit()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = c.fetchone()[0]
+        applied = []
+        rebuild = False
+        for version, description, steps in MIGRATIONS:
+            if version <= current:
+                continue
+            for step in steps:
+                if step is REBUILD_ROLLUPS:
+                    rebuild = True
+                elif callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                      (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            applied.append(version)
+        if rebuild:
+            rebuild_rollups(c)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
 
 # ---------------------------
 # Helper Functions for Time Calculations
 # ---------------------------
+@lru_cache(maxsize=4096)
+def _minutes_since_midnight(value):
+    """
+    Parses a "%H:%M" string into minutes since midnight, or None if it is malformed.
+    Cached, since a day only has 1440 distinct times; this turns per-row strptime into a dict hit.
+    """
+    try:
+        parsed = datetime.strptime(value.strip(), "%H:%M")
+    except (AttributeError, ValueError):
+        return None
+    return parsed.hour * 60 + parsed.minute
+
+@lru_cache(maxsize=65536)
+def _iso_week_of(date_str):
+    """Returns (iso_year, iso_week) for a "%Y-%m-%d" date, or None if it is malformed."""
+    try:
+        return tuple(datetime.strptime(date_str, "%Y-%m-%d").isocalendar()[:2])
+    except (TypeError, ValueError):
+        return None
+
+@lru_cache(maxsize=65536)
+def _epoch_day(date_str):
+    """Days between 1970-01-01 and a "%Y-%m-%d" date, or None if it is malformed."""
+    try:
+        return (datetime.strptime(date_str, "%Y-%m-%d") - datetime(1970, 1, 1)).days
+    except (TypeError, ValueError):
+        return None
+
+def session_columns(date_str, check_in, check_out):
+    """
+    Integer columns stored next to a session's text fields: (start_min, end_min), in minutes
+    since 1970-01-01 00:00 local time; a session that runs past midnight simply ends on the
+    next day's minutes. end_min is None while the session is open.
+    """
+    day = _epoch_day(date_str)
+    start = _minutes_since_midnight(check_in) if check_in else None
+    if day is None or start is None:
+        return None, None
+    start_min = day * 1440 + start
+    end = _minutes_since_midnight(check_out) if check_out else None
+    end_min = None if end is None else start_min + (end - start) % 1440
+    return start_min, end_min
+
+@lru_cache(maxsize=65536)
+def calendar_day(date_str):
+    """
+    The calendar row for a "%Y-%m-%d" date: (iso_year, iso_week, month, weekday, is_workday,
+    is_holiday, baseline_minutes), or None if it is malformed. Monday to Friday are workdays
+    unless listed in HOLIDAYS; only workdays expect WORKDAY_BASELINE_MINUTES.
+    """
+    try:
+        day = datetime.strptime(date_str, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+    iso_year, iso_week, weekday = day.isocalendar()
+    holidays = app.config["HOLIDAYS"]
+    is_holiday = date_str in holidays or date_str[5:] in holidays
+    is_workday = weekday <= 5 and not is_holiday
+    return (iso_year, iso_week, date_str[:7], weekday, int(is_workday), int(is_holiday),
+            app.config["WORKDAY_BASELINE_MINUTES"] if is_workday else 0)
+
+# The calendar table holds calendar_day() for every date of each year it covers, so reports
+# group by ISO year and week, and compare against each day's baseline, in SQL. Years are
+# added as dates in them are written.
+def fill_calendar(c, years):
+    """(Re)writes the calendar rows for whole years."""
+    rows = []
+    for year in years:
+        day = datetime(year, 1, 1)
+        while day.year == year:
+            date_str = day.strftime("%Y-%m-%d")
+            rows.append((date_str,) + calendar_day(date_str))
+            day += timedelta(days=1)
+    c.executemany("INSERT OR REPLACE INTO calendar (date, iso_year, iso_week, month, weekday, is_workday, "
+                  "is_holiday, baseline_minutes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+def ensure_calendar(c, years):
+    """Fills in whichever of the given years the calendar does not cover yet."""
+    missing = []
+    for year in sorted(set(years)):
+        c.execute("SELECT 1 FROM calendar WHERE date=?", (f"{year:04d}-12-31",))
+        if c.fetchone() is None:
+            missing.append(year)
+    if missing:
+        fill_calendar(c, missing)
+
+def _data_years(c, table, where="", params=()):
+    """The distinct years of the dates in a table, skipping malformed ones."""
+    c.execute(f"SELECT DISTINCT substr(date, 1, 4) FROM {table} {where}", params)
+    return [int(row[0]) for row in c.fetchall() if row[0] and row[0].isdigit() and 0 < int(row[0]) < 10000]
+
+@timed("flex")
 def calculate_daily_and_weekly_flex(logs):
     """
     Groups all complete sessions by day.
-    Each day's work minutes are summed and compared against an 8‑hour (480 minute) baseline.
-    Returns dictionaries for daily totals, daily flex, weekly hours, weekly flex, and overall flex.
+    Each day's work minutes are summed and compared against that day's calendar baseline.
+    Returns dictionaries for daily totals, daily flex, weekly hours, weekly flex (keyed by
+    (iso_year, iso_week)), and overall flex.
+
+    Works in a single pass of integer arithmetic on minutes since midnight; times and dates
+    are parsed once per distinct value rather than once per row.
     """
+    parse = _minutes_since_midnight
     daily_totals = {}
-    fmt = "%H:%M"
-    
     for log in logs:
-        date_str = log[1]
-        if not log[2] or not log[3]:
+        check_in, check_out = log[2], log[3]
+        if not check_in or not check_out:
             continue  # skip incomplete sessions
-        try:
-            check_in = datetime.strptime(log[2].strip(), fmt)
-            check_out = datetime.strptime(log[3].strip(), fmt)
-        except ValueError:
+        start = parse(check_in)
+        end = parse(check_out)
+        if start is None or end is None:
             continue
-        if check_out < check_in:
-            check_out += timedelta(days=1)
-        duration = (check_out - check_in).total_seconds() / 60
+        duration = end - start
+        if duration < 0:
+            duration += 1440  # session ran past midnight
+        date_str = log[1]
         daily_totals[date_str] = daily_totals.get(date_str, 0) + duration
 
     daily_flex = {}
@@ -89,10 +815,12 @@ def calculate_daily_and_weekly_flex(logs):
     weekly_flex = {}
     total_flex = 0
     for date_str, minutes in daily_totals.items():
-        flex = minutes - 480  # baseline: 8 hours per day
+        day = calendar_day(date_str)
+        if day is None:
+            raise ValueError(f"invalid date {date_str!r}")
+        flex = minutes - day[6]
         daily_flex[date_str] = flex
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        week = dt.isocalendar()[1]
+        week = day[:2]
         weekly_hours[week] = weekly_hours.get(week, 0) + minutes
         weekly_flex[week] = weekly_flex.get(week, 0) + flex
         total_flex += flex
@@ -104,17 +832,761 @@ def calculate_flex_time(date, check_in, lunch_out, lunch_in, check_out):
     Calculates the raw session duration (in minutes) from check-in to check-out.
     No default lunch break is assumed.
     """
-    fmt = "%H:%M"
     if not check_in or not check_out:
         return 0
-    try:
-        check_in_dt = datetime.strptime(check_in.strip(), fmt)
-        check_out_dt = datetime.strptime(check_out.strip(), fmt)
-    except ValueError:
+    start = _minutes_since_midnight(check_in)
+    end = _minutes_since_midnight(check_out)
+    if start is None or end is None:
         return 0
-    if check_out_dt < check_in_dt:
-        check_out_dt += timedelta(days=1)
-    return (check_out_dt - check_in_dt).total_seconds() / 60
+    duration = end - start
+    if duration < 0:
+        duration += 1440
+    return duration
+
+# ---------------------------
+# Flex Rollups
+# ---------------------------
+# daily_summary holds one row per user and worked day (complete sessions only);
+# weekly_summary rolls those days up by ISO year and week. Both are refreshed in the
+# same transaction as every time_logs write, so reads never have to revisit old sessions.
+def _iso_week_bounds(date_str):
+    """Returns (iso_year, iso_week, monday, sunday) for a "%Y-%m-%d" date."""
+    day = datetime.strptime(date_str, "%Y-%m-%d").date()
+    iso_year, iso_week, weekday = day.isocalendar()
+    monday = day - timedelta(days=weekday - 1)
+    return iso_year, iso_week, monday.isoformat(), (monday + timedelta(days=6)).isoformat()
+
+def refresh_rollups(c, user_id, dates):
+    """Recomputes the rollup rows for the given dates and the ISO weeks they fall in."""
+    weeks = set()
+    valid = []
+    for date_str in set(dates):
+        try:
+            weeks.add(_iso_week_bounds(date_str))
+        except (TypeError, ValueError):
+            continue
+        valid.append(date_str)
+    ensure_calendar(c, {int(date_str[:4]) for date_str in valid})
+    for date_str in valid:
+        c.execute("SELECT SUM(end_min - start_min), COUNT(*) FROM time_logs "
+                  "WHERE user_id=? AND date=? AND end_min IS NOT NULL", (user_id, date_str))
+        minutes, sessions = c.fetchone()
+        if sessions:
+            c.execute("INSERT OR REPLACE INTO daily_summary (user_id, date, minutes, sessions) VALUES (?, ?, ?, ?)",
+                      (user_id, date_str, minutes, sessions))
+        else:
+            c.execute("DELETE FROM daily_summary WHERE user_id=? AND date=?", (user_id, date_str))
+    for iso_year, iso_week, monday, sunday in weeks:
+        c.execute("SELECT SUM(s.minutes), COUNT(*), SUM(cal.baseline_minutes) FROM daily_summary s "
+                  "JOIN calendar cal ON cal.date = s.date WHERE s.user_id=? AND s.date BETWEEN ? AND ?",
+                  (user_id, monday, sunday))
+        minutes, days, baseline = c.fetchone()
+        if days:
+            c.execute("INSERT OR REPLACE INTO weekly_summary (user_id, iso_year, iso_week, minutes, days, baseline) "
+                      "VALUES (?, ?, ?, ?, ?, ?)", (user_id, iso_year, iso_week, minutes, days, baseline))
+        else:
+            c.execute("DELETE FROM weekly_summary WHERE user_id=? AND iso_year=? AND iso_week=?",
+                      (user_id, iso_year, iso_week))
+    if weeks:
+        _refresh_user_totals(c, user_id)
+
+def refresh_rollup_range(c, user_id, first, last):
+    """
+    Set-based refresh_rollups for every date from first to last ("%Y-%m-%d") and the ISO
+    weeks they fall in, for bulk writes where a few statements per date would hold the
+    write lock far longer.
+    """
+    first_week, last_week = _iso_week_bounds(first), _iso_week_bounds(last)
+    ensure_calendar(c, _data_years(c, "time_logs", "WHERE user_id=? AND date BETWEEN ? AND ?", (user_id, first, last)))
+    c.execute("DELETE FROM daily_summary WHERE user_id=? AND date BETWEEN ? AND ?", (user_id, first, last))
+    c.execute("""
+        INSERT INTO daily_summary (user_id, date, minutes, sessions)
+        SELECT user_id, date, SUM(end_min - start_min), COUNT(*)
+        FROM time_logs
+        WHERE user_id=? AND date BETWEEN ? AND ? AND end_min IS NOT NULL
+        GROUP BY date
+    """, (user_id, first, last))
+    c.execute("DELETE FROM weekly_summary WHERE user_id=? AND (iso_year, iso_week) BETWEEN (?, ?) AND (?, ?)",
+              (user_id,) + first_week[:2] + last_week[:2])
+    c.execute("""
+        INSERT INTO weekly_summary (user_id, iso_year, iso_week, minutes, days, baseline)
+        SELECT s.user_id, cal.iso_year, cal.iso_week, SUM(s.minutes), COUNT(*), SUM(cal.baseline_minutes)
+        FROM daily_summary s
+        JOIN calendar cal ON cal.date = s.date
+        WHERE s.user_id=? AND s.date BETWEEN ? AND ?
+        GROUP BY cal.iso_year, cal.iso_week
+    """, (user_id, first_week[2], last_week[3]))
+    _refresh_user_totals(c, user_id)
+
+def _refresh_user_totals(c, user_id):
+    """
+    Re-sums one user's weekly rollups into user_totals (a handful of rows per year),
+    plus whatever archived years carried over.
+    """
+    c.execute("""
+        INSERT OR REPLACE INTO user_totals (user_id, minutes, days, flex)
+        SELECT ?, COALESCE(SUM(minutes), 0), COALESCE(SUM(days), 0), COALESCE(SUM(flex), 0)
+        FROM (SELECT minutes, days, minutes - baseline AS flex FROM weekly_summary WHERE user_id=?
+              UNION ALL
+              SELECT minutes, days, flex FROM flex_carryover WHERE user_id=?)
+    """, (user_id, user_id, user_id))
+
+def _recompute_rollups(c, user_id):
+    """
+    Full recompute of one user's rollups from the text columns of time_logs, as
+    {date: (minutes, sessions)} and {(year, week): (minutes, days, baseline)}. Independent of
+    the integer columns and the calendar table, so verify_rollups also catches those drifting.
+    Sessions with a malformed date are skipped, as refresh_rollups skips them.
+    """
+    c.execute("SELECT id, date, check_in, check_out FROM time_logs WHERE user_id=?", (user_id,))
+    logs = [log for log in c.fetchall() if _iso_week_of(log[1]) is not None]
+    daily_totals = calculate_daily_and_weekly_flex(logs)[0]
+    sessions = {}
+    for log in logs:
+        if log[2] and log[3]:
+            sessions[log[1]] = sessions.get(log[1], 0) + 1
+    daily = {date_str: (minutes, sessions[date_str]) for date_str, minutes in daily_totals.items()}
+    weekly = {}
+    for date_str, (minutes, _) in daily.items():
+        day = calendar_day(date_str)
+        week_minutes, days, baseline = weekly.get(day[:2], (0, 0, 0))
+        weekly[day[:2]] = (week_minutes + minutes, days + 1, baseline + day[6])
+    return daily, weekly
+
+def rebuild_rollups(c, user_id=None):
+    """Throws away and rebuilds the rollups for one user, or for everyone, entirely in SQL."""
+    where, params = ("WHERE user_id=?", (user_id,)) if user_id is not None else ("", ())
+    c.execute(f"DELETE FROM daily_summary {where}", params)
+    c.execute(f"DELETE FROM weekly_summary {where}", params)
+    c.execute(f"DELETE FROM user_totals {where}", params)
+    filter_user = "AND user_id=?" if user_id is not None else ""
+    filter_summary = "WHERE s.user_id=?" if user_id is not None else ""
+    c.execute(f"""
+        INSERT INTO daily_summary (user_id, date, minutes, sessions)
+        SELECT user_id, date, SUM(end_min - start_min), COUNT(*)
+        FROM time_logs
+        WHERE end_min IS NOT NULL {filter_user}
+        GROUP BY user_id, date
+    """, params)
+    ensure_calendar(c, _data_years(c, "daily_summary", where, params))
+    c.execute(f"""
+        INSERT INTO weekly_summary (user_id, iso_year, iso_week, minutes, days, baseline)
+        SELECT s.user_id, cal.iso_year, cal.iso_week, SUM(s.minutes), COUNT(*), SUM(cal.baseline_minutes)
+        FROM daily_summary s
+        JOIN calendar cal ON cal.date = s.date
+        {filter_summary}
+        GROUP BY s.user_id, cal.iso_year, cal.iso_week
+    """, params)
+    c.execute(f"""
+        INSERT INTO user_totals (user_id, minutes, days, flex)
+        SELECT user_id, SUM(minutes), SUM(days), SUM(flex)
+        FROM (SELECT user_id, minutes, days, minutes - baseline AS flex FROM weekly_summary {where}
+              UNION ALL
+              SELECT user_id, minutes, days, flex FROM flex_carryover {where})
+        GROUP BY user_id
+    """, params * 2)
+
+def verify_rollups(c):
+    """Compares the stored rollups with a full recompute. Returns a list of mismatch descriptions."""
+    problems = []
+    c.execute("SELECT DISTINCT user_id FROM time_logs UNION SELECT DISTINCT user_id FROM daily_summary "
+              "UNION SELECT user_id FROM flex_carryover")
+    for (uid,) in c.fetchall():
+        daily, weekly = _recompute_rollups(c, uid)
+        c.execute("SELECT date, minutes, sessions FROM daily_summary WHERE user_id=?", (uid,))
+        stored_daily = {row[0]: (row[1], row[2]) for row in c.fetchall()}
+        c.execute("SELECT iso_year, iso_week, minutes, days, baseline FROM weekly_summary WHERE user_id=?", (uid,))
+        stored_weekly = {(row[0], row[1]): tuple(row[2:]) for row in c.fetchall()}
+        for label, expected, stored in (("day", daily, stored_daily), ("week", weekly, stored_weekly)):
+            for key in expected.keys() | stored.keys():
+                want, have = expected.get(key), stored.get(key)
+                if want is None or have is None or abs(want[0] - have[0]) > 1e-6 or want[1:] != have[1:]:
+                    problems.append(f"user {uid} {label} {key}: expected {want}, stored {have}")
+        c.execute("SELECT COALESCE(SUM(minutes), 0), COALESCE(SUM(days), 0) FROM flex_carryover WHERE user_id=?",
+                  (uid,))
+        carried = c.fetchone()
+        want = (sum(week[0] for week in weekly.values()) + carried[0],
+                sum(week[1] for week in weekly.values()) + carried[1])
+        c.execute("SELECT minutes, days FROM user_totals WHERE user_id=?", (uid,))
+        have = c.fetchone() or (0, 0)
+        if abs(want[0] - have[0]) > 1e-6 or want[1] != have[1]:
+            problems.append(f"user {uid} totals: expected {want}, stored {tuple(have)}")
+    return problems
+
+def load_weekly_flex(c, user_id):
+    """
+    Reads weekly hours, weekly flex and the overall flex balance from weekly_summary.
+    Weeks are keyed by ISO week label ("2025-W01"), oldest first. The balance includes
+    the flex carried over from archived years, so archive files are never opened here.
+    """
+    c.execute("""
+        SELECT printf('%d-W%02d', iso_year, iso_week), minutes, minutes - baseline
+        FROM weekly_summary
+        WHERE user_id=?
+        ORDER BY iso_year, iso_week
+    """, (user_id,))
+    weekly_hours = {}
+    weekly_flex = {}
+    for week, minutes, flex in c.fetchall():
+        weekly_hours[week] = minutes
+        weekly_flex[week] = flex
+    c.execute("SELECT COALESCE(SUM(flex), 0) FROM flex_carryover WHERE user_id=?", (user_id,))
+    return weekly_hours, weekly_flex, sum(weekly_flex.values()) + c.fetchone()[0]
+
+# ---------------------------
+# Report Cache
+# ---------------------------
+# Built reports are cached per user under a key that includes users.data_version. Every
+# write to a user's logs or diary bumps that version in the same transaction, so stale
+# entries are simply never asked for again and age out of the LRU.
+class LocalCacheBackend:
+    """An in-process LRU cache holding at most `max_entries` reports."""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class SharedCacheBackend:
+    """
+    Stores pickled reports in a Redis-compatible client shared by all workers.
+    Any object with get(key) and set(key, value, ex=seconds) works, e.g. redis.Redis or a
+    local stand-in; size bounding is left to the server's eviction policy (allkeys-lru).
+    """
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(key, pickle.dumps(value), ex=self.ttl)
+
+class ReportCache:
+    """Per-user report cache with hit/miss counters."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, kind, user_id, version, build):
+        key = f"report:{kind}:{user_id}:{version}"
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = build()
+            self.backend.set(key, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        stats = {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+        if isinstance(self.backend, LocalCacheBackend):
+            stats["entries"] = len(self.backend)
+            stats["max_entries"] = self.backend.max_entries
+        return stats
+
+_report_cache = None
+
+def get_report_cache():
+    """Returns the process-wide report cache, built from the REPORT_CACHE_* settings on first use."""
+    global _report_cache
+    if _report_cache is None:
+        cfg = app.config
+        if cfg["REPORT_CACHE_BACKEND"] == "shared":
+            client = cfg.get("REPORT_CACHE_CLIENT")
+            if client is None:
+                try:
+                    import redis
+                except ImportError:
+                    raise RuntimeError("REPORT_CACHE_BACKEND='shared' needs the redis package "
+                                       "or a REPORT_CACHE_CLIENT object")
+                client = redis.Redis.from_url(cfg["REPORT_CACHE_REDIS_URL"])
+            backend = SharedCacheBackend(client, cfg["REPORT_CACHE_TTL"])
+        else:
+            backend = LocalCacheBackend(cfg["REPORT_CACHE_MAX_ENTRIES"])
+        _report_cache = ReportCache(backend)
+    return _report_cache
+
+def get_data_version(c, user_id):
+    c.execute("SELECT data_version FROM users WHERE id=?", (user_id,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+def bump_data_version(c, user_id):
+    """Marks every cached report for the user as stale. Call inside the writing transaction."""
+    c.execute("UPDATE users SET data_version = data_version + 1 WHERE id=?", (user_id,))
+
+def logs_with_weeks(logs):
+    """
+    Normalizes (id, date, check_in, check_out, flex_time, week label) rows for the templates,
+    defaulting a missing work time or week to 0.
+    """
+    return [(log[0], log[1], log[2], log[3], log[4] if log[4] is not None else 0, log[5] or 0) for log in logs]
+
+def load_diary_by_log(c, user_id, log_ids):
+    """Returns {time_log_id: [(id, time_log_id, timestamp, note, end_time), ...]} for the given logs."""
+    diary_by_log = {}
+    if not log_ids:
+        return diary_by_log
+    placeholders = ",".join("?" * len(log_ids))
+    c.execute(f"SELECT id, time_log_id, timestamp, note, end_time FROM diary "
+              f"WHERE user_id=? AND time_log_id IN ({placeholders}) ORDER BY time_log_id, timestamp",
+              (user_id, *log_ids))
+    for entry in c.fetchall():
+        diary_by_log.setdefault(entry[1], []).append(entry)
+    return diary_by_log
+
+# ---------------------------
+# Background Jobs
+# ---------------------------
+# Slow work (removing a deleted user's history, imports, archiving a year, rebuilding the
+# rollups) runs on a small thread pool instead of in the request. Each job is a row in the
+# jobs table, so its status and progress can be polled at /jobs/<id> and survive a restart.
+# Handlers commit every JOB_BATCH_SIZE rows and pause briefly, so check-ins waiting on the
+# write lock get it between batches. Each queued or running job is leased by the process
+# holding it (jobs.owner), which renews jobs.heartbeat_at; only jobs whose lease has run out
+# are recovered, so a starting worker never takes over a live sibling's jobs.
+JOB_HANDLERS = {}
+_job_executor = None
+_job_runner_started = False
+_job_lease_started = False
+_job_lock = threading.Lock()
+
+def job_handler(kind, resumable=False):
+    """
+    Registers fn(job, conn, params) as the handler for jobs of this kind. Its return value is
+    stored as the job result. Resumable handlers are safe to run twice and are re-queued if
+    the process stopped while they were queued or running; the rest are marked interrupted.
+    """
+    def decorator(fn):
+        JOB_HANDLERS[kind] = (fn, resumable)
+        return fn
+    return decorator
+
+class Job:
+    """Handed to job handlers for reporting progress."""
+    def __init__(self, conn, job_id):
+        self.conn = conn
+        self.id = job_id
+
+    def progress(self, done, total=None):
+        """Records progress and renews the lease; both are committed with the handler's current batch."""
+        self.conn.execute("UPDATE jobs SET progress=?, total=COALESCE(?, total), heartbeat_at=? WHERE id=?",
+                          (done, total, int(time.time()), self.id))
+
+    def checkpoint(self, done, total=None):
+        """Records progress, commits the batch and gives waiting writers a turn at the lock."""
+        self.progress(done, total)
+        self.conn.commit()
+        time.sleep(app.config["JOB_BATCH_PAUSE_MS"] / 1000)
+
+def get_job_executor():
+    global _job_executor
+    with _job_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=app.config["JOB_WORKERS"], thread_name_prefix="job")
+        return _job_executor
+
+def job_owner():
+    """Names this process in jobs.owner. Forked workers each get their own name."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def enqueue_job(conn, kind, params, created_by=None):
+    """
+    Queues a job in the caller's transaction, leased to this process, commits it and hands
+    it to the worker pool (or runs it right away on conn when JOBS_EAGER is set).
+    Returns the job id.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    c = conn.cursor()
+    c.execute("INSERT INTO jobs (kind, params, status, created_by, created_at, owner, heartbeat_at) "
+              "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+              (kind, json.dumps(params), created_by, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+               job_owner(), int(time.time())))
+    job_id = c.lastrowid
+    conn.commit()
+    if app.config["JOBS_EAGER"]:
+        _execute_job(conn, job_id)
+    else:
+        start_job_lease()
+        get_job_executor().submit(_run_job, job_id)
+    return job_id
+
+def _run_job(job_id):
+    with app.app_context(), db_connection() as conn:
+        _execute_job(conn, job_id)
+
+def _execute_job(conn, job_id):
+    c = conn.cursor()
+    # Claiming the row makes a job that was submitted twice run only once.
+    c.execute("UPDATE jobs SET status='running', started_at=?, owner=?, heartbeat_at=? WHERE id=? AND status='queued'",
+              (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_owner(), int(time.time()), job_id))
+    claimed = c.rowcount == 1
+    conn.commit()
+    if not claimed:
+        return
+    c.execute("SELECT kind, params FROM jobs WHERE id=?", (job_id,))
+    kind, params = c.fetchone()
+    started = time.perf_counter()
+    try:
+        result = JOB_HANDLERS[kind][0](Job(conn, job_id), conn, json.loads(params or "{}"))
+    except Exception as exc:
+        if conn.in_transaction:
+            conn.rollback()
+        app.logger.exception("Job %s (%s) failed", job_id, kind)
+        c.execute("UPDATE jobs SET status='failed', error=?, finished_at=? WHERE id=?",
+                  (str(exc), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id))
+    else:
+        c.execute("UPDATE jobs SET status='done', result=?, finished_at=? WHERE id=?",
+                  (json.dumps(result), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id))
+    conn.commit()
+    METRICS["job"].observe(time.perf_counter() - started, kind)
+
+def recover_jobs(conn):
+    """
+    Takes over queued or running jobs whose owner has not renewed its lease for
+    JOB_LEASE_SECONDS, i.e. whose process is gone. Resumable ones are re-queued under this
+    process and the others marked interrupted; jobs of live processes are left alone.
+    Runs at startup in create_app() and from every process's lease thread.
+    Returns the ids of the re-queued jobs.
+    """
+    c = conn.cursor()
+    now = int(time.time())
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT id, kind FROM jobs WHERE status IN ('queued', 'running') "
+              "AND (heartbeat_at IS NULL OR heartbeat_at < ?)", (now - app.config["JOB_LEASE_SECONDS"],))
+    requeued = []
+    for job_id, kind in c.fetchall():
+        if JOB_HANDLERS.get(kind, (None, False))[1]:
+            c.execute("UPDATE jobs SET status='queued', owner=?, heartbeat_at=? WHERE id=?",
+                      (job_owner(), now, job_id))
+            requeued.append(job_id)
+        else:
+            c.execute("UPDATE jobs SET status='interrupted', finished_at=? WHERE id=?",
+                      (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id))
+    conn.commit()
+    return requeued
+
+def start_job_lease():
+    """
+    Starts this process's lease thread once. Every JOB_LEASE_SECONDS / 4 it renews the
+    lease on the jobs this process holds, then recovers and runs the jobs of processes
+    that stopped renewing theirs, such as a crashed worker or the previous deployment.
+    """
+    global _job_lease_started
+    with _job_lock:
+        if _job_lease_started:
+            return
+        _job_lease_started = True
+    interval = app.config["JOB_LEASE_SECONDS"] / 4
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context(), db_connection() as conn:
+                    conn.execute("UPDATE jobs SET heartbeat_at=? WHERE owner=? AND status IN ('queued', 'running')",
+                                 (int(time.time()), job_owner()))
+                    conn.commit()
+                    for job_id in recover_jobs(conn):
+                        get_job_executor().submit(_run_job, job_id)
+            except Exception:
+                app.logger.exception("Renewing job leases failed")
+
+    threading.Thread(target=loop, name="job-lease", daemon=True).start()
+
+def start_job_runner(conn):
+    """
+    Submits the jobs waiting in the queue, once per process. With several workers each one
+    submits them, and the claim in _execute_job lets only one of them run each job.
+    """
+    global _job_runner_started
+    with _job_lock:
+        if _job_runner_started:
+            return
+        _job_runner_started = True
+    start_job_lease()
+    c = conn.cursor()
+    c.execute("SELECT id FROM jobs WHERE status='queued' ORDER BY id")
+    for (job_id,) in c.fetchall():
+        get_job_executor().submit(_run_job, job_id)
+
+@app.before_request
+def start_background_workers():
+    # Started by the first request rather than at import, so CLI commands and the
+    # reloader's watcher process never pick up jobs.
+    if not _job_runner_started:
+        start_job_runner(get_db())
+        start_session_sweeper()
+        start_login_session_purger()
+
+def load_job(c, job_id):
+    c.execute("SELECT id, kind, status, progress, total, result, error, created_by, created_at, started_at, "
+              "finished_at FROM jobs WHERE id=?", (job_id,))
+    row = c.fetchone()
+    if not row:
+        return None
+    job = dict(zip(("id", "kind", "status", "progress", "total", "result", "error", "created_by",
+                    "created_at", "started_at", "finished_at"), row))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+@app.route("/jobs/<int:job_id>")
+@login_required
+def job_status(job_id):
+    job = load_job(get_db().cursor(), job_id)
+    if not job or (job["created_by"] != session["user_id"] and session.get("role") != "admin"):
+        abort(404)
+    if request.args.get("format") == "json":
+        return jsonify(job)
+    return render_template("job.html", job=job)
+
+# ---------------------------
+# Password Hashing
+# ---------------------------
+# Hashing is deliberately slow, so a shift logging in at once could take every CPU from
+# check-ins. All hashing runs on PASSWORD_HASH_WORKERS dedicated threads (hashlib releases
+# the GIL while it works), and once PASSWORD_HASH_MAX_PENDING hashes are running or queued,
+# further logins are turned away at once with 503 instead of piling up.
+class HashingBusy(Exception):
+    """Raised when the hashing pool is full or a hash took longer than PASSWORD_HASH_TIMEOUT."""
+
+class HashingPool:
+    def __init__(self, workers, max_pending, timeout):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.timeout = timeout
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+        return HashingBusy()
+
+    def run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise self._reject()
+        started = time.perf_counter()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:  # not the builtin TimeoutError before Python 3.11
+            raise self._reject()
+        finally:
+            METRICS["password_hash"].observe(time.perf_counter() - started, operation)
+
+_hashing_pool = None
+
+def get_hashing_pool():
+    global _hashing_pool
+    with _job_lock:
+        if _hashing_pool is None:
+            _hashing_pool = HashingPool(app.config["PASSWORD_HASH_WORKERS"], app.config["PASSWORD_HASH_MAX_PENDING"],
+                                        app.config["PASSWORD_HASH_TIMEOUT"])
+        return _hashing_pool
+
+def hash_password(password):
+    """Hashes with PASSWORD_HASH_METHOD on the hashing pool. May raise HashingBusy."""
+    return get_hashing_pool().run("generate", generate_password_hash, password, app.config["PASSWORD_HASH_METHOD"])
+
+def verify_password(stored_hash, password):
+    """Checks a password on the hashing pool. May raise HashingBusy."""
+    return get_hashing_pool().run("check", check_password_hash, stored_hash, password)
+
+@lru_cache(maxsize=8)
+def _hash_method_prefix(method):
+    # Werkzeug fills in default parameters ("scrypt" -> "scrypt:32768:8:1"); read them off a real hash.
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+def password_needs_rehash(stored_hash):
+    """True when a stored hash was made with a method or cost other than PASSWORD_HASH_METHOD."""
+    return stored_hash.split("$", 1)[0] != _hash_method_prefix(app.config["PASSWORD_HASH_METHOD"])
+
+# ---------------------------
+# Login Sessions
+# ---------------------------
+# The session cookie carries a random session id plus flash messages. Who is logged in,
+# and with which role (from users.is_admin at login), is stored in login_sessions. An
+# in-process LRU answers most lookups, so login_required and admin_required are memory hits.
+# A cached entry is re-read after LOGIN_SESSION_CACHE_SECONDS. That bounds how long another
+# worker process keeps honouring a session revoked elsewhere; in the revoking process it
+# ends at once.
+SESSION_AUTH_KEYS = ("user_id", "username", "role")
+
+def role_for(c, user_id):
+    c.execute("SELECT is_admin FROM users WHERE id=?", (user_id,))
+    row = c.fetchone()
+    return "admin" if row and row[0] else "user"
+
+def _session_key(sid):
+    # Only a digest of the id is stored, so a copy of the database cannot be used to log in.
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+class LoginSessionStore:
+    """login_sessions with an LRU of (user_id, username, role, expires_at, checked_at) in front."""
+    def __init__(self):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, record, now):
+        with self._lock:
+            self._cache[key] = tuple(record) + (now,)
+            self._cache.move_to_end(key)
+            while len(self._cache) > app.config["LOGIN_SESSION_CACHE_SIZE"]:
+                self._cache.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def create(self, c, user_id, username):
+        """Stores a new session in the caller's transaction and returns its id for the cookie."""
+        sid = secrets.token_urlsafe(32)
+        now = int(time.time())
+        record = (user_id, username, role_for(c, user_id), now + int(app.config["LOGIN_SESSION_TTL_HOURS"] * 3600))
+        c.execute("INSERT INTO login_sessions (id, user_id, username, role, created_at, expires_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)", (_session_key(sid),) + record[:3] + (now, record[3]))
+        self._remember(_session_key(sid), record, now)
+        return sid
+
+    def get(self, sid):
+        """(user_id, username, role) for a live session id, or None if it is unknown, expired or revoked."""
+        key = _session_key(sid)
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[4] < app.config["LOGIN_SESSION_CACHE_SECONDS"]:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[:3] if entry[3] > now else None
+            self.misses += 1
+        c = get_db().cursor()
+        c.execute("SELECT user_id, username, role, expires_at FROM login_sessions WHERE id=?", (key,))
+        row = c.fetchone()
+        if row is None or row[3] <= now:
+            self._forget(key)
+            return None
+        self._remember(key, row, now)
+        return row[:3]
+
+    def revoke(self, c, sid):
+        key = _session_key(sid)
+        c.execute("DELETE FROM login_sessions WHERE id=?", (key,))
+        self._forget(key)
+
+    def revoke_user(self, c, user_id):
+        """Ends every session of a user in the caller's transaction; returns how many there were."""
+        c.execute("DELETE FROM login_sessions WHERE user_id=?", (user_id,))
+        revoked = c.rowcount
+        with self._lock:
+            for key in [key for key, entry in self._cache.items() if entry[0] == user_id]:
+                del self._cache[key]
+        return revoked
+
+    def purge(self, c):
+        """Deletes expired sessions; returns how many."""
+        now = int(time.time())
+        c.execute("DELETE FROM login_sessions WHERE expires_at <= ?", (now,))
+        purged = c.rowcount
+        with self._lock:
+            for key in [key for key, entry in self._cache.items() if entry[3] <= now]:
+                del self._cache[key]
+        return purged
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+login_sessions = LoginSessionStore()
+
+class LoginSessionInterface(SecureCookieSessionInterface):
+    """
+    Cookie sessions whose user_id/username/role come from login_sessions, looked up by the
+    cookie's "sid", and are never written to the cookie itself.
+    """
+    def open_session(self, app, request):
+        s = super().open_session(app, request)
+        if s is None:
+            return None
+        # Identity carried by the cookie itself (e.g. from before server-side sessions) is ignored.
+        stale = [dict.pop(s, key) for key in SESSION_AUTH_KEYS if key in s]
+        record = login_sessions.get(s["sid"]) if "sid" in s else None
+        if record:
+            dict.update(s, zip(SESSION_AUTH_KEYS, record))
+        elif "sid" in s or stale:
+            s.pop("sid", None)
+            s.modified = True
+        return s
+
+    def save_session(self, app, session, response):
+        cookie = self.session_class({key: value for key, value in session.items() if key not in SESSION_AUTH_KEYS})
+        cookie.modified, cookie.accessed = session.modified, session.accessed
+        super().save_session(app, cookie, response)
+
+app.session_interface = LoginSessionInterface()
+
+_session_purger_started = False
+
+def start_login_session_purger():
+    """Starts the thread deleting expired login sessions once, unless LOGIN_SESSION_PURGE_SECONDS is unset."""
+    global _session_purger_started
+    interval = app.config["LOGIN_SESSION_PURGE_SECONDS"]
+    with _job_lock:
+        if _session_purger_started or not interval:
+            return
+        _session_purger_started = True
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context(), db_connection() as conn:
+                    purged = login_sessions.purge(conn.cursor())
+                    conn.commit()
+                if purged:
+                    app.logger.info("Purged %d expired login session(s)", purged)
+            except Exception:
+                app.logger.exception("Login session purge failed")
+
+    threading.Thread(target=loop, name="login-session-purger", daemon=True).start()
 
 # ---------------------------
 # Authentication Routes
@@ -127,17 +1599,20 @@ def register():
         if not username or not password:
             flash("Username and password are required.")
             return redirect(url_for("register"))
-        conn = sqlite3.connect("time_manager.db")
+        conn = get_db()
         c = conn.cursor()
-        c.execute("SELECT id FROM users WHERE username=?", (username,))
+        # Names differing only in case would be confused with each other, "Admin" with "admin".
+        c.execute("SELECT id FROM users WHERE username=? COLLATE NOCASE", (username,))
         if c.fetchone():
             flash("Username already exists.")
-            conn.close()
             return redirect(url_for("register"))
-        hashed_pw = generate_password_hash(password)
+        try:
+            hashed_pw = hash_password(password)
+        except HashingBusy:
+            flash("The server is busy. Please try again in a moment.")
+            return render_template("register.html"), 503, {"Retry-After": "5"}
         c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_pw))
         conn.commit()
-        conn.close()
         flash("Registration successful! Please log in.")
         return redirect(url_for("login"))
     return render_template("register.html")
@@ -147,14 +1622,27 @@ def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
-        conn = sqlite3.connect("time_manager.db")
+        conn = get_db()
         c = conn.cursor()
         c.execute("SELECT id, password FROM users WHERE username=?", (username,))
         user = c.fetchone()
-        conn.close()
-        if user and check_password_hash(user[1], password):
-            session["user_id"] = user[0]
-            session["username"] = username
+        try:
+            valid = bool(user) and verify_password(user[1], password)
+        except HashingBusy:
+            flash("Too many people are signing in right now. Please try again in a moment.")
+            return render_template("login.html"), 503, {"Retry-After": "5"}
+        if valid:
+            if password_needs_rehash(user[1]):
+                # Upgrade to the configured method and cost now that we have the plain password.
+                try:
+                    c.execute("UPDATE users SET password=? WHERE id=?", (hash_password(password), user[0]))
+                    conn.commit()
+                except HashingBusy:
+                    pass  # tried again at the next login
+            if "sid" in session:
+                login_sessions.revoke(c, session["sid"])
+            session["sid"] = login_sessions.create(c, user[0], username)
+            conn.commit()
             flash("Logged in successfully!")
             return redirect(url_for("index"))
         else:
@@ -165,32 +1653,185 @@ def login():
 @app.route("/logout")
 @login_required
 def logout():
+    conn = get_db()
+    login_sessions.revoke(conn.cursor(), session["sid"])
+    conn.commit()
     session.clear()
     flash("You have been logged out.")
     return redirect(url_for("login"))
 
+# ---------------------------
+# JSON API
+# ---------------------------
+# The /api/v1 endpoints serve the dashboard's data as JSON. Each response carries a weak ETag
+# made from the user's data_version, which every write bumps. A client revalidating with
+# If-None-Match therefore gets 304 after a single primary-key lookup, before any
+# aggregation runs. ?fields=a,b.c trims the payload (and skips loading what is not
+# asked for), and bodies of API_GZIP_MIN_BYTES or more are gzipped when the client accepts it.
+API_VERSION = 1
+
+def _parse_api_fields(raw):
+    """Turns "logs.date,next" into a selection tree {"logs": {"date": None}, "next": None}."""
+    tree = {}
+    for field in raw.split(","):
+        parts = [part for part in field.strip().split(".") if part]
+        node = tree
+        for depth, part in enumerate(parts):
+            if depth == len(parts) - 1:
+                node[part] = None
+            elif part in node and node[part] is None:
+                break  # the whole parent is already selected
+            else:
+                node = node.setdefault(part, {})
+    return tree
+
+def _select_fields(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_select_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _select_fields(value[key], sub) for key, sub in tree.items() if key in value}
+    return value
+
+def api_wants(path):
+    """True unless ?fields= was given and selects nothing at or below the dotted path."""
+    tree = g.get("api_fields")
+    for part in path.split("."):
+        if tree is None:
+            return True
+        if part not in tree:
+            return False
+        tree = tree[part]
+    return True
+
+def json_api(f):
+    """Wraps a view returning a dict with the login check, ETag/304, ?fields= and gzip handling."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "user_id" not in session:
+            return jsonify({"error": "Login required."}), 401
+        version = get_data_version(get_db().cursor(), session["user_id"])
+        # The date is part of the tag because "today" and "this week" move on without a write.
+        key = "|".join((request.path, request.query_string.decode(), datetime.now().strftime("%Y-%m-%d")))
+        etag = f'{API_VERSION}-{session["user_id"]}-{version}-{hashlib.sha1(key.encode()).hexdigest()[:12]}'
+        headers = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding, Cookie"}
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304, headers=headers)
+            response.set_etag(etag, weak=True)
+            return response
+        g.api_fields = _parse_api_fields(request.args["fields"]) if request.args.get("fields") else None
+        result = f(*args, **kwargs)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
+        body = json.dumps(_select_fields(result, g.api_fields), separators=(",", ":")).encode("utf-8")
+        response = Response(body, mimetype="application/json", headers=headers)
+        if len(body) >= app.config["API_GZIP_MIN_BYTES"] and "gzip" in request.accept_encodings:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag, weak=True)
+        return response
+    return decorated_function
+
+@app.route("/api/v1/status")
+@json_api
+def api_status():
+    """Check-in state, the running diary activity, this week's totals and the flex balance."""
+    c = get_db().cursor()
+    user_id = session["user_id"]
+    today = datetime.now()
+    iso_year, iso_week, _ = today.isocalendar()
+    c.execute("SELECT id, date, check_in FROM time_logs WHERE check_out IS NULL AND user_id=? "
+              "ORDER BY date DESC, check_in DESC LIMIT 1", (user_id,))
+    open_log = c.fetchone()
+    c.execute("""
+        SELECT d.id, d.timestamp, d.note
+        FROM diary d
+        JOIN time_logs t ON d.time_log_id = t.id
+        WHERE d.user_id=? AND t.date=? AND d.end_time IS NULL
+        ORDER BY d.timestamp DESC LIMIT 1
+    """, (user_id, today.strftime("%Y-%m-%d")))
+    active_diary = c.fetchone()
+    c.execute("SELECT minutes, days, baseline FROM weekly_summary WHERE user_id=? AND iso_year=? AND iso_week=?",
+              (user_id, iso_year, iso_week))
+    minutes, days, baseline = c.fetchone() or (0, 0, 0)
+    c.execute("SELECT flex FROM user_totals WHERE user_id=?", (user_id,))
+    row = c.fetchone()
+    return {
+        "checked_in": open_log is not None,
+        "open_session": {"id": open_log[0], "date": open_log[1], "check_in": open_log[2]} if open_log else None,
+        "active_diary": ({"id": active_diary[0], "timestamp": active_diary[1], "note": active_diary[2]}
+                         if active_diary else None),
+        "week": {"iso_year": iso_year, "iso_week": iso_week, "minutes": minutes, "days": days,
+                 "baseline": baseline, "flex": minutes - baseline},
+        "flex_balance": row[0] if row else 0,
+    }
+
+@app.route("/api/v1/days")
+@json_api
+def api_days():
+    """Daily totals between ?start= and ?end= (YYYY-MM-DD, both optional), oldest first."""
+    for value in (request.args.get("start"), request.args.get("end")):
+        if value and _iso_week_of(value) is None:
+            return {"error": "start and end must be in YYYY-MM-DD format."}, 400
+    c = get_db().cursor()
+    c.execute("SELECT s.date, s.minutes, s.sessions, cal.baseline_minutes FROM daily_summary s "
+              "JOIN calendar cal ON cal.date = s.date WHERE s.user_id=? AND s.date BETWEEN ? AND ? "
+              "ORDER BY s.date", (session["user_id"], request.args.get("start") or "0000-01-01",
+                                  request.args.get("end") or "9999-12-31"))
+    return {"days": [{"date": date, "minutes": minutes, "sessions": sessions, "baseline": baseline,
+                      "flex": minutes - baseline} for date, minutes, sessions, baseline in c.fetchall()]}
+
+@app.route("/api/v1/weeks")
+@json_api
+def api_weeks():
+    """Every week's hours and flex, the flex carried over from archived years and the balance."""
+    c = get_db().cursor()
+    user_id = session["user_id"]
+    payload = {}
+    if api_wants("weeks"):
+        c.execute("SELECT iso_year, iso_week, minutes, days, baseline FROM weekly_summary WHERE user_id=? "
+                  "ORDER BY iso_year, iso_week", (user_id,))
+        payload["weeks"] = [{"iso_year": year, "iso_week": week, "minutes": minutes, "days": days,
+                             "baseline": baseline, "flex": minutes - baseline}
+                            for year, week, minutes, days, baseline in c.fetchall()]
+    if api_wants("carryover"):
+        c.execute("SELECT year, minutes, days, flex FROM flex_carryover WHERE user_id=? ORDER BY year", (user_id,))
+        payload["carryover"] = [{"year": year, "minutes": minutes, "days": days, "flex": flex}
+                                for year, minutes, days, flex in c.fetchall()]
+    c.execute("SELECT flex FROM user_totals WHERE user_id=?", (user_id,))
+    row = c.fetchone()
+    payload["flex_balance"] = row[0] if row else 0
+    return payload
+
 # ---------------------------
 # Main App Routes (User-Specific)
 # ---------------------------
 @app.route("/")
 @login_required
 def index():
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM time_logs WHERE user_id=? ORDER BY date DESC, check_in DESC", (session["user_id"],))
+    # Only the current week and the previous DASHBOARD_WEEKS weeks are rendered;
+    # older weeks are fetched on demand from /api/logs.
+    today_dt = datetime.now()
+    window_start = (today_dt - timedelta(days=today_dt.weekday(), weeks=app.config["DASHBOARD_WEEKS"])).strftime("%Y-%m-%d")
+    c.execute("SELECT t.id, t.date, t.check_in, t.check_out, t.flex_time, printf('%d-W%02d', cal.iso_year, cal.iso_week) "
+              "FROM time_logs t LEFT JOIN calendar cal ON cal.date = t.date "
+              "WHERE t.user_id=? AND t.date >= ? ORDER BY t.date DESC, t.check_in DESC, t.id DESC",
+              (session["user_id"], window_start))
     logs = c.fetchall()
     
-    daily_totals, daily_flex, weekly_hours, weekly_flex, total_flex = calculate_daily_and_weekly_flex(logs)
+    weekly_hours, weekly_flex, total_flex = load_weekly_flex(c, session["user_id"])
     
     c.execute("SELECT COUNT(*) FROM time_logs WHERE check_out IS NULL AND user_id=?", (session["user_id"],))
     is_checked_in = c.fetchone()[0] > 0
     
-    # Query for diary entries (for the listing table, if needed)
-    c.execute("SELECT id, time_log_id, timestamp, note, end_time FROM diary WHERE user_id=? ORDER BY timestamp", (session["user_id"],))
-    diary_entries = c.fetchall()
+    # Diary entries for the shown logs, grouped by time_log_id for the listing table.
+    diary_by_log = load_diary_by_log(c, session["user_id"], [log[0] for log in logs])
     
     # Query for an active diary entry for today (if one exists).
-    today = datetime.now().strftime("%Y-%m-%d")
+    today = today_dt.strftime("%Y-%m-%d")
     c.execute("""
         SELECT d.id, d.timestamp, d.note 
         FROM diary d 
@@ -200,46 +1841,93 @@ def index():
     """, (session["user_id"], today))
     active_diary = c.fetchone()
     
-    logs_with_weeks = []
-    for log in logs:
-        try:
-            week = datetime.strptime(log[1], "%Y-%m-%d").isocalendar()[1]
-        except Exception:
-            week = 0
-        logs_with_weeks.append((log[0], log[1], log[2], log[3], log[4] if log[4] is not None else 0, week))
-    conn.close()
     return render_template("index.html", 
-                           logs=logs_with_weeks, 
-                           daily_totals=daily_totals, 
-                           daily_flex=daily_flex, 
+                           logs=logs_with_weeks(logs), 
                            weekly_hours=weekly_hours, 
                            weekly_flex=weekly_flex, 
                            total_flex=total_flex, 
                            is_checked_in=is_checked_in, 
-                           diary_entries=diary_entries,
+                           diary_by_log=diary_by_log,
                            active_diary=active_diary,
+                           older_cursor={"before_date": window_start, "before_check_in": "", "before_id": 0},
                            username=session.get("username"))
 
-
+@app.route("/api/logs")
+@app.route("/api/v1/logs")
+@json_api
+def api_logs():
+    """
+    Keyset-paginated time logs older than (before_date, before_check_in, before_id), newest first.
+    The id breaks ties between sessions with the same date and check-in time.
+    Each log carries its week totals and diary entries; `next` is the cursor for the following page.
+    """
+    before_date = request.args.get("before_date", "9999-12-31")
+    before_check_in = request.args.get("before_check_in", "")
+    before_id = request.args.get("before_id", 0, type=int)
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 500)
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("""
+        SELECT t.id, t.date, t.check_in, t.check_out, t.flex_time, printf('%d-W%02d', cal.iso_year, cal.iso_week)
+        FROM time_logs t
+        LEFT JOIN calendar cal ON cal.date = t.date
+        WHERE t.user_id=? AND (t.date, t.check_in, t.id) < (?, ?, ?)
+        ORDER BY t.date DESC, t.check_in DESC, t.id DESC
+        LIMIT ?
+    """, (session["user_id"], before_date, before_check_in, before_id, limit))
+    logs = c.fetchall()
+    weekly_hours, weekly_flex = {}, {}
+    if api_wants("logs.week_minutes") or api_wants("logs.week_flex"):
+        weekly_hours, weekly_flex, _ = load_weekly_flex(c, session["user_id"])
+    diary_by_log = {}
+    if api_wants("logs.diary"):
+        diary_by_log = load_diary_by_log(c, session["user_id"], [log[0] for log in logs])
+    items = []
+    for log in logs_with_weeks(logs):
+        items.append({
+            "id": log[0],
+            "date": log[1],
+            "check_in": log[2],
+            "check_out": log[3],
+            "work_minutes": log[4],
+            "week": log[5],
+            "week_minutes": weekly_hours.get(log[5], 0),
+            "week_flex": weekly_flex.get(log[5], 0),
+            "edit_url": url_for("edit", id=log[0]),
+            "delete_url": url_for("delete", id=log[0]),
+            "diary": [{"id": entry[0], "timestamp": entry[2], "note": entry[3], "end_time": entry[4],
+                       "edit_url": url_for("edit_diary", id=entry[0])}
+                      for entry in diary_by_log.get(log[0], [])],
+        })
+    next_cursor = None
+    if len(logs) == limit:
+        next_cursor = {"before_date": logs[-1][1], "before_check_in": logs[-1][2], "before_id": logs[-1][0]}
+    return {"logs": items, "next": next_cursor}
 
 @app.route("/toggle_check", methods=["POST"])
 @login_required
 def toggle_check():
     now = datetime.now().strftime("%H:%M")
     today = datetime.now().strftime("%Y-%m-%d")
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
     c.execute("SELECT id, date, check_in FROM time_logs WHERE check_out IS NULL AND date=? AND user_id=?", (today, session["user_id"]))
     row = c.fetchone()
     if row:
         work_minutes = calculate_flex_time(row[1], row[2], None, None, now)
-        c.execute("UPDATE time_logs SET check_out=?, flex_time=? WHERE id=?", (now, work_minutes, row[0]))
+        end_min = session_columns(row[1], row[2], now)[1]
+        c.execute("UPDATE time_logs SET check_out=?, flex_time=?, end_min=? WHERE id=?",
+                  (now, work_minutes, end_min, row[0]))
+        refresh_rollups(c, session["user_id"], [row[1]])
         flash("Checked out successfully!")
     else:
-        c.execute("INSERT INTO time_logs (date, check_in, user_id) VALUES (?, ?, ?)", (today, now, session["user_id"]))
+        c.execute("INSERT INTO time_logs (date, check_in, user_id, start_min, end_min) "
+                  "VALUES (?, ?, ?, ?, ?)",
+                  (today, now, session["user_id"]) + session_columns(today, now, None))
+        ensure_calendar(c, [int(today[:4])])  # reports join today's date before it is rolled up
         flash("Checked in successfully!")
+    bump_data_version(c, session["user_id"])
     conn.commit()
-    conn.close()
     return redirect(url_for("index"))
 
 @app.route("/add_day", methods=["GET", "POST"])
@@ -252,13 +1940,19 @@ def add_day():
         if not check_in or not check_out:
             flash("Both check-in and check-out times are required.")
             return redirect(url_for("add_day"))
+        if _iso_week_of(date) is None:
+            flash("Date must be in YYYY-MM-DD format.")
+            return redirect(url_for("add_day"))
         work_minutes = calculate_flex_time(date, check_in, None, None, check_out)
-        conn = sqlite3.connect("time_manager.db")
+        conn = get_db()
         c = conn.cursor()
-        c.execute("INSERT INTO time_logs (date, check_in, check_out, flex_time, user_id) VALUES (?, ?, ?, ?, ?)",
-                  (date, check_in, check_out, work_minutes, session["user_id"]))
+        c.execute("INSERT INTO time_logs (date, check_in, check_out, flex_time, user_id, "
+                  "start_min, end_min) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (date, check_in, check_out, work_minutes, session["user_id"])
+                  + session_columns(date, check_in, check_out))
+        refresh_rollups(c, session["user_id"], [date])
+        bump_data_version(c, session["user_id"])
         conn.commit()
-        conn.close()
         flash("Entry added successfully!")
         return redirect(url_for("index"))
     return render_template("add_day.html")
@@ -266,12 +1960,16 @@ def add_day():
 @app.route("/delete/<int:id>", methods=["POST"])
 @login_required
 def delete(id):
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
+    c.execute("SELECT date FROM time_logs WHERE id=? AND user_id=?", (id, session["user_id"]))
+    row = c.fetchone()
     c.execute("DELETE FROM diary WHERE time_log_id=? AND user_id=?", (id, session["user_id"]))
     c.execute("DELETE FROM time_logs WHERE id=? AND user_id=?", (id, session["user_id"]))
+    if row:
+        refresh_rollups(c, session["user_id"], [row[0]])
+    bump_data_version(c, session["user_id"])
     conn.commit()
-    conn.close()
     flash("Entry deleted successfully!")
     return redirect(url_for("index"))
 
@@ -281,42 +1979,41 @@ def add_diary():
     now = datetime.now().strftime("%H:%M")
     date = datetime.now().strftime("%Y-%m-%d")
     note = request.form["note"]
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
     c.execute("SELECT id FROM time_logs WHERE date=? AND user_id=? ORDER BY check_in DESC LIMIT 1", (date, session["user_id"]))
     time_log_id = c.fetchone()
     if time_log_id:
         c.execute("INSERT INTO diary (time_log_id, timestamp, note, user_id) VALUES (?, ?, ?, ?)", 
                   (time_log_id[0], now, note, session["user_id"]))
+        bump_data_version(c, session["user_id"])
         conn.commit()
         flash("Diary entry added!")
     else:
         flash("No time log found for today. Add a time entry first!")
-    conn.close()
     return redirect(url_for("index"))
 
 @app.route("/edit_diary/<int:id>", methods=["GET", "POST"])
 @login_required
 def edit_diary(id):
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
     if request.method == "POST":
         timestamp = request.form["timestamp"]
         note = request.form["note"]
         c.execute("UPDATE diary SET timestamp=?, note=? WHERE id=? AND user_id=?", (timestamp, note, id, session["user_id"]))
+        bump_data_version(c, session["user_id"])
         conn.commit()
-        conn.close()
         flash("Diary entry updated!")
         return redirect(url_for("index"))
     c.execute("SELECT id, timestamp, note FROM diary WHERE id=? AND user_id=?", (id, session["user_id"]))
     entry = c.fetchone()
-    conn.close()
     return render_template("edit_diary.html", entry=entry)
 
 @app.route("/edit/<int:id>", methods=["GET", "POST"])
 @login_required
 def edit(id):
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
     if request.method == "POST":
         check_in = request.form.get("check_in", "").strip()
@@ -327,15 +2024,18 @@ def edit(id):
         c.execute("SELECT date FROM time_logs WHERE id=? AND user_id=?", (id, session["user_id"]))
         date = c.fetchone()[0]
         work_minutes = calculate_flex_time(date, check_in, None, None, check_out)
-        c.execute("UPDATE time_logs SET check_in=?, check_out=?, flex_time=? WHERE id=? AND user_id=?", 
-                  (check_in, check_out, work_minutes, id, session["user_id"]))
+        start_min, end_min = session_columns(date, check_in, check_out)
+        c.execute("UPDATE time_logs SET check_in=?, check_out=?, flex_time=?, start_min=?, end_min=? "
+                  "WHERE id=? AND user_id=?", 
+                  (check_in, check_out, work_minutes, start_min, end_min, id, session["user_id"]))
+        refresh_rollups(c, session["user_id"], [date])
+        bump_data_version(c, session["user_id"])
         conn.commit()
-        conn.close()
         flash("Entry updated successfully!")
         return redirect(url_for("index"))
-    c.execute("SELECT * FROM time_logs WHERE id=? AND user_id=?", (id, session["user_id"]))
+    c.execute("SELECT id, date, check_in, check_out, flex_time, user_id FROM time_logs WHERE id=? AND user_id=?",
+              (id, session["user_id"]))
     log = c.fetchone()
-    conn.close()
     return render_template("edit.html", log=log)
 
 # ---------------------------
@@ -344,17 +2044,19 @@ def edit(id):
 @app.route("/diary")
 @login_required
 def diary():
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
-    c.execute("""
-        SELECT d.id, t.date, d.timestamp, d.note 
-        FROM diary d 
-        JOIN time_logs t ON d.time_log_id = t.id 
-        WHERE d.user_id=? 
-        ORDER BY t.date DESC, d.timestamp DESC
-    """, (session["user_id"],))
-    entries = c.fetchall()
-    conn.close()
+    entries = []
+    for db in archive_sources(conn, newest_first=True):
+        c.execute(f"""
+            SELECT d.id, t.date, d.timestamp, d.note, '{db}' != 'main'
+            FROM {db}.diary d 
+            JOIN {db}.time_logs t ON d.time_log_id = t.id 
+            WHERE d.user_id=? 
+            ORDER BY t.date DESC, d.timestamp DESC
+        """, (session["user_id"],))
+        entries += c.fetchall()
+    entries.sort(key=lambda entry: (entry[1], entry[2]), reverse=True)
     
     diary_by_date = {}
     for entry in entries:
@@ -362,7 +2064,8 @@ def diary():
         diary_by_date.setdefault(date_str, []).append({
             "id": entry[0],
             "time": entry[2],
-            "note": entry[3]
+            "note": entry[3],
+            "archived": bool(entry[4])
         })
     return render_template("diary.html", diary_by_date=diary_by_date)
 @app.route("/diary/activate", methods=["POST"])
@@ -374,21 +2077,20 @@ def diary_activate():
         return redirect(url_for("index"))
     today = datetime.now().strftime("%Y-%m-%d")
     now_time = datetime.now().strftime("%H:%M")
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
     # Find today's time log for the user.
     c.execute("SELECT id FROM time_logs WHERE date=? AND user_id=? ORDER BY check_in DESC LIMIT 1", (today, session["user_id"]))
     row = c.fetchone()
     if not row:
         flash("No time log found for today. Please check in first.")
-        conn.close()
         return redirect(url_for("index"))
     time_log_id = row[0]
     # Insert a new diary entry (active, so end_time remains NULL).
     c.execute("INSERT INTO diary (time_log_id, timestamp, note, user_id) VALUES (?, ?, ?, ?)",
               (time_log_id, now_time, note, session["user_id"]))
+    bump_data_version(c, session["user_id"])
     conn.commit()
-    conn.close()
     flash("Diary activated!")
     return redirect(url_for("index"))
 
@@ -397,7 +2099,7 @@ def diary_activate():
 def diary_deactivate():
     now_time = datetime.now().strftime("%H:%M")
     today = datetime.now().strftime("%Y-%m-%d")
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
     # Find the active diary entry for today.
     c.execute("""
@@ -409,49 +2111,131 @@ def diary_deactivate():
     row = c.fetchone()
     if not row:
         flash("No active diary entry found.")
-        conn.close()
         return redirect(url_for("index"))
     diary_id = row[0]
     c.execute("UPDATE diary SET end_time=? WHERE id=?", (now_time, diary_id))
+    bump_data_version(c, session["user_id"])
     conn.commit()
-    conn.close()
     flash("Diary deactivated!")
     return redirect(url_for("index"))
 
+# Search results come back from SQLite with these around each hit, then get escaped and
+# turned into <mark> tags, so notes can never inject markup.
+_HIT_START, _HIT_END = "\x02", "\x03"
+
+def build_fts_query(text):
+    """
+    Turns user input into an FTS5 MATCH expression: "quoted text" is a phrase, a trailing *
+    makes a prefix search, and all terms must match. Returns None if nothing searchable is left.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase.strip():
+            terms.append('"' + phrase.strip().replace('"', '""') + '"')
+            continue
+        prefix = word.endswith("*")
+        word = re.sub(r"[^\w]", "", word)
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+def _highlight(snippet):
+    return Markup(str(escape(snippet)).replace(_HIT_START, "<mark>").replace(_HIT_END, "</mark>"))
+
+def _diary_fts_available(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE name='diary_fts'")
+    return c.fetchone() is not None
+
+@app.route("/diary/search")
+@login_required
+def diary_search():
+    query = request.args.get("q", "").strip()
+    start = request.args.get("start") or "0000-01-01"
+    end = request.args.get("end") or "9999-12-31"
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = app.config["SEARCH_PAGE_SIZE"]
+    results = []
+    has_next = False
+    match = build_fts_query(query)
+    if match:
+        c = get_db().cursor()
+        params = (session["user_id"], start, end, per_page + 1, (page - 1) * per_page)
+        if _diary_fts_available(c):
+            # The owner token narrows the match inside the index; bm25 weighs only the note column
+            c.execute(f"""
+                SELECT d.id, t.date, d.timestamp, d.end_time,
+                       snippet(diary_fts, 0, '{_HIT_START}', '{_HIT_END}', '…', 16), bm25(diary_fts, 1.0, 0.0)
+                FROM diary_fts
+                JOIN diary d ON d.id = diary_fts.rowid
+                JOIN time_logs t ON t.id = d.time_log_id
+                WHERE diary_fts MATCH ? AND d.user_id=? AND t.date BETWEEN ? AND ?
+                ORDER BY bm25(diary_fts, 1.0, 0.0), t.date DESC
+                LIMIT ? OFFSET ?
+            """, (f'uid:"u{session["user_id"]}" AND note:({match})',) + params)
+        else:
+            like = "%" + re.sub(r'[*"]', "", query).replace("%", "").replace("_", "") + "%"
+            c.execute("""
+                SELECT d.id, t.date, d.timestamp, d.end_time, d.note, 0
+                FROM diary d
+                JOIN time_logs t ON t.id = d.time_log_id
+                WHERE d.note LIKE ? AND d.user_id=? AND t.date BETWEEN ? AND ?
+                ORDER BY t.date DESC, d.timestamp DESC
+                LIMIT ? OFFSET ?
+            """, (like,) + params)
+        rows = c.fetchall()
+        has_next = len(rows) > per_page
+        for entry_id, date, timestamp, end_time, snippet, rank in rows[:per_page]:
+            results.append({"id": entry_id, "date": date, "time": timestamp, "end_time": end_time,
+                            "snippet": _highlight(snippet), "rank": rank})
+    if request.args.get("format") == "json":
+        return jsonify({"query": query, "page": page, "has_next": has_next,
+                        "results": [dict(result, snippet=str(result["snippet"])) for result in results]})
+    return render_template("diary_search.html", query=query, start=request.args.get("start", ""),
+                           end=request.args.get("end", ""), page=page, has_next=has_next, results=results)
+
 @app.route("/diary_report")
 @login_required
 def diary_report():
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
-    c.execute("""
-        SELECT t.date, d.timestamp, d.note 
-        FROM diary d 
-        JOIN time_logs t ON d.time_log_id = t.id 
-        WHERE d.user_id=? 
-        ORDER BY t.date ASC, d.timestamp ASC
-    """, (session["user_id"],))
-    diary_entries = c.fetchall()
-    c.execute("""
-        SELECT date, SUM(flex_time) as total_minutes 
-        FROM time_logs 
-        WHERE check_in IS NOT NULL AND check_out IS NOT NULL AND user_id=? 
-        GROUP BY date
-    """, (session["user_id"],))
-    daily_data = c.fetchall()
-    conn.close()
-    
-    daily_totals = {date: total_minutes for date, total_minutes in daily_data}
+    user_id = session["user_id"]
+    weekly_report, monthly_report = get_report_cache().get_or_build(
+        "diary_report", user_id, get_data_version(c, user_id), lambda: build_diary_report(c, user_id))
+    return render_template("diary_report.html", 
+                           weekly_report=weekly_report, 
+                           monthly_report=monthly_report)
+
+def build_diary_report(c, user_id):
+    """
+    Groups a user's diary notes and worked minutes by ISO week ("2025-W01") and by month,
+    including archived years.
+    """
+    diary_entries = []
+    daily_totals = {}
+    for db in archive_sources(c.connection):
+        c.execute(f"""
+            SELECT t.date, printf('%d-W%02d', cal.iso_year, cal.iso_week), cal.month, d.timestamp, d.note
+            FROM {db}.diary d 
+            JOIN {db}.time_logs t ON d.time_log_id = t.id 
+            JOIN main.calendar cal ON cal.date = t.date
+            WHERE d.user_id=? 
+            ORDER BY t.date ASC, d.timestamp ASC
+        """, (user_id,))
+        diary_entries += c.fetchall()
+        c.execute(f"SELECT date, minutes FROM {db}.daily_summary WHERE user_id=?", (user_id,))
+        daily_totals.update(c.fetchall())
+    diary_entries.sort(key=lambda entry: (entry[0], entry[3]))
     
     diary_by_date = {}
-    for date, timestamp, note in diary_entries:
+    periods = {}
+    for date, week, month, timestamp, note in diary_entries:
         diary_by_date.setdefault(date, []).append({"time": timestamp, "note": note})
+        periods[date] = (week, month)
     
     weekly_report = {}
     monthly_report = {}
     for date_str, notes in diary_by_date.items():
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        week = dt.isocalendar()[1]
-        month = dt.strftime("%Y-%m")
+        week, month = periods[date_str]
         
         if week not in weekly_report:
             weekly_report[week] = {"dates": {}, "total_minutes": 0}
@@ -470,9 +2254,131 @@ def diary_report():
         }
         monthly_report[month]["total_minutes"] += minutes
     
-    return render_template("diary_report.html", 
-                           weekly_report=weekly_report, 
-                           monthly_report=monthly_report)
+    return weekly_report, monthly_report
+
+def build_diary_analytics(c, user_id, start="0000-01-01", end="9999-12-31"):
+    """
+    Time spent per activity and per day, ISO week and month, from diary entry intervals.
+    One pass over the entries in (user_id, time_log_id, timestamp) order: each session's
+    entries are held only while they are compared against the session itself for overlapping
+    activities, untracked gaps and time logged outside it. Entries that are still running
+    in an open session are counted but not timed, so the result only changes on a write.
+    Archived years in the range are read from their archive files, one at a time.
+    """
+    worked = {}
+
+    def entry_rows():
+        for db in archive_sources(c.connection, start, end):
+            c.execute(f"SELECT s.date, s.minutes, cal.iso_year, cal.iso_week, cal.month FROM {db}.daily_summary s "
+                      "JOIN main.calendar cal ON cal.date = s.date WHERE s.user_id=? AND s.date BETWEEN ? AND ?",
+                      (user_id, start, end))
+            worked.update((row[0], row[1:]) for row in c.fetchall())
+            c.execute(f"""
+                SELECT d.time_log_id, t.date, cal.iso_year, cal.iso_week, cal.month, t.start_min, t.end_min,
+                       d.timestamp, d.end_time, d.note
+                FROM {db}.diary d
+                JOIN {db}.time_logs t ON t.id = d.time_log_id
+                JOIN main.calendar cal ON cal.date = t.date
+                WHERE d.user_id=? AND t.date BETWEEN ? AND ?
+                ORDER BY d.user_id, d.time_log_id, d.timestamp
+            """, (user_id, start, end))
+            yield from c
+
+    activities = {}
+    days = {}
+    in_progress = 0
+
+    def day_totals(date, iso_year, iso_week, month):
+        if date not in days:
+            days[date] = {"date": date, "iso_year": iso_year, "iso_week": iso_week, "month": month,
+                          "worked": worked[date][0] if date in worked else 0, "activity": 0, "tracked": 0,
+                          "untracked": 0, "overlap": 0, "outside": 0, "entries": 0}
+        return days[date]
+
+    for _, entries in groupby(entry_rows(), key=itemgetter(0)):
+        entries = list(entries)
+        _, date, iso_year, iso_week, month, session_start, session_end = entries[0][:7]
+        if session_start is None:
+            continue
+        day_start = session_start - session_start % 1440
+        # Times before check-in belong to the next day only if the session runs past midnight.
+        past_midnight = session_end is None or session_end >= day_start + 1440
+        intervals = []
+        for row in entries:
+            begin = _minutes_since_midnight(row[7])
+            finish = _minutes_since_midnight(row[8]) if row[8] else None
+            if begin is None:
+                continue
+            begin_min = day_start + begin
+            if begin_min < session_start and past_midnight:
+                begin_min += 1440
+            if finish is not None:
+                intervals.append((begin_min, begin_min + (finish - begin) % 1440, row[9]))
+            elif session_end is not None:
+                intervals.append((begin_min, max(begin_min, session_end), row[9]))
+            else:
+                in_progress += 1
+        intervals.sort()
+        totals = day_totals(date, iso_year, iso_week, month)
+        # An open session has no end yet, so nothing in it counts as outside.
+        upper = session_end if session_end is not None else max([interval[1] for interval in intervals],
+                                                                default=session_start)
+        covered = session_start  # end of the union of entries seen so far, clipped to the session
+        for begin_min, finish_min, note in intervals:
+            inside_begin, inside_end = max(begin_min, session_start), min(finish_min, upper)
+            inside = max(0, inside_end - inside_begin)
+            activity = activities.setdefault(note, {"note": note, "minutes": 0, "entries": 0})
+            activity["minutes"] += finish_min - begin_min
+            activity["entries"] += 1
+            totals["activity"] += finish_min - begin_min
+            totals["outside"] += finish_min - begin_min - inside
+            totals["entries"] += 1
+            if inside:
+                totals["overlap"] += max(0, min(inside_end, covered) - inside_begin)
+                if session_end is not None:
+                    totals["tracked"] += max(0, inside_end - max(inside_begin, covered))
+                covered = max(covered, inside_end)
+
+    for date, (_, iso_year, iso_week, month) in worked.items():
+        day_totals(date, iso_year, iso_week, month)
+    weeks, months = {}, {}
+    summed = ("worked", "activity", "tracked", "untracked", "overlap", "outside", "entries")
+    for date in sorted(days):
+        totals = days[date]
+        totals["untracked"] = max(0, totals["worked"] - totals["tracked"])
+        week = weeks.setdefault((totals["iso_year"], totals["iso_week"]), dict.fromkeys(summed, 0))
+        month = months.setdefault(totals["month"], dict.fromkeys(summed, 0))
+        for key in summed:
+            week[key] += totals[key]
+            month[key] += totals[key]
+    overall = dict.fromkeys(summed, 0)
+    for totals in months.values():
+        for key in summed:
+            overall[key] += totals[key]
+    return {
+        "activities": sorted(activities.values(), key=lambda activity: (-activity["minutes"], activity["note"])),
+        "days": [days[date] for date in sorted(days)],
+        "weeks": [dict(totals, iso_year=key[0], iso_week=key[1]) for key, totals in weeks.items()],
+        "months": [dict(totals, month=key) for key, totals in months.items()],
+        "totals": overall,
+        "in_progress": in_progress,
+    }
+
+@app.route("/diary/analytics")
+@login_required
+def diary_analytics():
+    start, end = request.args.get("start", ""), request.args.get("end", "")
+    if (start and _iso_week_of(start) is None) or (end and _iso_week_of(end) is None):
+        flash("Dates must be in YYYY-MM-DD format.")
+        return redirect(url_for("diary_analytics"))
+    c = get_db().cursor()
+    user_id = session["user_id"]
+    analytics = get_report_cache().get_or_build(
+        f"diary_analytics:{start}:{end}", user_id, get_data_version(c, user_id),
+        lambda: build_diary_analytics(c, user_id, start or "0000-01-01", end or "9999-12-31"))
+    if request.args.get("format") == "json":
+        return jsonify(analytics)
+    return render_template("diary_analytics.html", analytics=analytics, start=start, end=end)
 
 # ---------------------------
 # Summary Route (Optional)
@@ -480,15 +2386,12 @@ def diary_report():
 @app.route("/summary")
 @login_required
 def summary():
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM time_logs WHERE user_id=? ORDER BY date", (session["user_id"],))
-    logs = c.fetchall()
-    daily_totals, daily_flex, weekly_hours, weekly_flex, total_flex = calculate_daily_and_weekly_flex(logs)
-    conn.close()
+    user_id = session["user_id"]
+    weekly_hours, weekly_flex, total_flex = get_report_cache().get_or_build(
+        "summary", user_id, get_data_version(c, user_id), lambda: load_weekly_flex(c, user_id))
     return render_template("summary.html", 
-                           daily_totals=daily_totals, 
-                           daily_flex=daily_flex, 
                            weekly_hours=weekly_hours, 
                            weekly_flex=weekly_flex, 
                            total_flex=total_flex)
@@ -499,7 +2402,7 @@ def summary():
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if session.get("username", "").lower() != "admin":
+        if session.get("role") != "admin":
             flash("Admins only.")
             return redirect(url_for("index"))
         return f(*args, **kwargs)
@@ -509,13 +2412,91 @@ def admin_required(f):
 @login_required
 @admin_required
 def admin():
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
     c.execute("SELECT id, username FROM users ORDER BY username")
     users = c.fetchall()
-    conn.close()
     return render_template("admin.html", users=users)
 
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition. Admins only, or a scraper presenting METRICS_TOKEN."""
+    token = app.config["METRICS_TOKEN"]
+    if not (token and request.headers.get("Authorization") == f"Bearer {token}"):
+        if session.get("role") != "admin":
+            abort(403)
+    lines = []
+    for histogram in METRICS.values():
+        lines.extend(histogram.render())
+    cache = get_report_cache().stats()
+    lines += ["# HELP tm_report_cache_hits_total Report cache hits.",
+              "# TYPE tm_report_cache_hits_total counter",
+              f"tm_report_cache_hits_total {cache['hits']}",
+              "# HELP tm_report_cache_misses_total Report cache misses.",
+              "# TYPE tm_report_cache_misses_total counter",
+              f"tm_report_cache_misses_total {cache['misses']}",
+              "# HELP tm_password_hash_rejected_total Logins and password changes turned away by the hashing pool.",
+              "# TYPE tm_password_hash_rejected_total counter",
+              f"tm_password_hash_rejected_total {get_hashing_pool().rejected}",
+              "# HELP tm_login_session_cache_hits_total Login session lookups answered from memory.",
+              "# TYPE tm_login_session_cache_hits_total counter",
+              f"tm_login_session_cache_hits_total {login_sessions.hits}",
+              "# HELP tm_login_session_cache_misses_total Login session lookups that read the database.",
+              "# TYPE tm_login_session_cache_misses_total counter",
+              f"tm_login_session_cache_misses_total {login_sessions.misses}"]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/cache_stats")
+@login_required
+@admin_required
+def admin_cache_stats():
+    return jsonify(get_report_cache().stats())
+
+TEAM_SORT_COLUMNS = {
+    "username": "u.username",
+    "week": "week_minutes",
+    "flex": "flex",
+    "checked_in": "checked_in",
+}
+
+@app.route("/admin/team")
+@login_required
+@admin_required
+def admin_team():
+    """
+    Team-wide hours this week, flex balance and check-in state, read from the
+    pre-aggregated rollups in one query, so cost depends on the page size rather than history.
+    """
+    sort = request.args.get("sort", "username")
+    if sort not in TEAM_SORT_COLUMNS:
+        sort = "username"
+    direction = "DESC" if request.args.get("dir") == "desc" else "ASC"
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = app.config["TEAM_PAGE_SIZE"]
+    iso_year, iso_week = datetime.now().isocalendar()[:2]
+    conn = get_db()
+    c = conn.cursor()
+    c.execute(f"""
+        SELECT u.id, u.username,
+               COALESCE(w.minutes, 0) AS week_minutes,
+               COALESCE(tot.flex, 0) AS flex,
+               EXISTS (SELECT 1 FROM time_logs o WHERE o.user_id = u.id AND o.check_out IS NULL) AS checked_in
+        FROM users u
+        LEFT JOIN weekly_summary w ON w.user_id = u.id AND w.iso_year = ? AND w.iso_week = ?
+        LEFT JOIN user_totals tot ON tot.user_id = u.id
+        ORDER BY {TEAM_SORT_COLUMNS[sort]} {direction}, u.username
+        LIMIT ? OFFSET ?
+    """, (iso_year, iso_week, per_page, (page - 1) * per_page))
+    members = c.fetchall()
+    c.execute("SELECT COUNT(*) FROM users")
+    pages = max((c.fetchone()[0] + per_page - 1) // per_page, 1)
+    if request.args.get("format") == "json":
+        return jsonify({"iso_year": iso_year, "iso_week": iso_week, "page": page, "pages": pages,
+                        "members": [{"user_id": m[0], "username": m[1], "week_minutes": m[2],
+                                     "flex": m[3], "checked_in": bool(m[4])} for m in members]})
+    return render_template("admin_team.html", members=members, sort=sort, direction=direction.lower(),
+                           page=page, pages=pages, iso_year=iso_year, iso_week=iso_week)
+
 @app.route("/admin/reset_password/<int:user_id>", methods=["GET", "POST"])
 @login_required
 @admin_required
@@ -525,13 +2506,17 @@ def admin_reset_password(user_id):
         if not new_password:
             flash("Please enter a new password.")
             return redirect(url_for("admin_reset_password", user_id=user_id))
-        hashed_pw = generate_password_hash(new_password)
-        conn = sqlite3.connect("time_manager.db")
+        try:
+            hashed_pw = hash_password(new_password)
+        except HashingBusy:
+            flash("The server is busy. Please try again in a moment.")
+            return redirect(url_for("admin_reset_password", user_id=user_id))
+        conn = get_db()
         c = conn.cursor()
         c.execute("UPDATE users SET password=? WHERE id=?", (hashed_pw, user_id))
+        login_sessions.revoke_user(c, user_id)
         conn.commit()
-        conn.close()
-        flash("Password reset successfully!")
+        flash("Password reset successfully! The user has been logged out everywhere.")
         return redirect(url_for("admin"))
     return render_template("admin_reset_password.html", user_id=user_id)
 
@@ -543,31 +2528,948 @@ def admin_delete_user(user_id):
     if user_id == session.get("user_id"):
         flash("You cannot delete your own account.")
         return redirect(url_for("admin"))
-    conn = sqlite3.connect("time_manager.db")
+    conn = get_db()
     c = conn.cursor()
+    # The account goes now; its time_logs and diary entries are removed in batches by a job.
+    c.execute("SELECT (SELECT COALESCE(MAX(id), 0) FROM time_logs), (SELECT COALESCE(MAX(id), 0) FROM diary)")
+    max_log_id, max_diary_id = c.fetchone()
     c.execute("DELETE FROM users WHERE id=?", (user_id,))
-    # Optionally, you can also delete associated time_logs and diary entries.
-    c.execute("DELETE FROM time_logs WHERE user_id=?", (user_id,))
-    c.execute("DELETE FROM diary WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
-    flash("User deleted successfully!")
+    login_sessions.revoke_user(c, user_id)
+    job_id = enqueue_job(conn, "delete_user_data",
+                         {"user_id": user_id, "max_log_id": max_log_id, "max_diary_id": max_diary_id},
+                         created_by=session["user_id"])
+    flash(f"User deleted successfully! Their time logs and diary are being removed (job {job_id}).")
     return redirect(url_for("admin"))
 
+@job_handler("delete_user_data", resumable=True)
+def delete_user_data(job, conn, params):
+    """
+    Deletes a removed user's diary entries and time logs JOB_BATCH_SIZE rows per transaction,
+    then purges them from the archive files and rebuilds their rollups. Only hot rows that
+    existed when the account was deleted are touched.
+    """
+    user_id = params["user_id"]
+    batch_size = app.config["JOB_BATCH_SIZE"]
+    c = conn.cursor()
+    tables = (("diary", params["max_diary_id"]), ("time_logs", params["max_log_id"]))
+    total = 0
+    for table, max_id in tables:
+        c.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id=? AND id<=?", (user_id, max_id))
+        total += c.fetchone()[0]
+    deleted = 0
+    job.checkpoint(deleted, total)
+    for table, max_id in tables:
+        while True:
+            c.execute(f"DELETE FROM {table} WHERE id IN "
+                      f"(SELECT id FROM {table} WHERE user_id=? AND id<=? LIMIT ?)", (user_id, max_id, batch_size))
+            if not c.rowcount:
+                break
+            deleted += c.rowcount
+            job.checkpoint(deleted)
+    deleted += purge_archived_user(conn, user_id)
+    c.execute("DELETE FROM flex_carryover WHERE user_id=?", (user_id,))
+    rebuild_rollups(c, user_id)
+    bump_data_version(c, user_id)
+    conn.commit()
+    return {"user_id": user_id, "deleted": deleted}
+
+@job_handler("rebuild_summaries", resumable=True)
+def rebuild_summaries_job(job, conn, params):
+    """Rebuilds the flex rollups one user per transaction, then verifies them."""
+    c = conn.cursor()
+    c.execute("SELECT id FROM users ORDER BY id")
+    user_ids = [row[0] for row in c.fetchall()]
+    job.checkpoint(0, len(user_ids))
+    for done, user_id in enumerate(user_ids, start=1):
+        rebuild_rollups(c, user_id)
+        bump_data_version(c, user_id)
+        job.checkpoint(done)
+    problems = verify_rollups(c)
+    return {"users": len(user_ids), "problem_count": len(problems), "problems": problems[:100]}
+
+ADMIN_JOBS = ("rebuild_summaries", "sweep_open_sessions")  # jobs admins can start from /admin/jobs
+
+@app.route("/admin/jobs", methods=["GET", "POST"])
+@login_required
+@admin_required
+def admin_jobs():
+    conn = get_db()
+    c = conn.cursor()
+    if request.method == "POST":
+        kind = request.form.get("kind")
+        if kind not in ADMIN_JOBS:
+            flash("Unknown job.")
+            return redirect(url_for("admin_jobs"))
+        job_id = enqueue_job(conn, kind, {}, created_by=session["user_id"])
+        return redirect(url_for("job_status", job_id=job_id))
+    c.execute("""
+        SELECT j.id, j.kind, j.status, j.progress, j.total, j.created_at, j.finished_at, j.error, u.username
+        FROM jobs j
+        LEFT JOIN users u ON u.id = j.created_by
+        ORDER BY j.id DESC
+        LIMIT 100
+    """)
+    jobs = c.fetchall()
+    if request.args.get("format") == "json":
+        keys = ("id", "kind", "status", "progress", "total", "created_at", "finished_at", "error", "created_by")
+        return jsonify([dict(zip(keys, row)) for row in jobs])
+    return render_template("admin_jobs.html", jobs=jobs)
+
+# ---------------------------
+# Payroll Export Routes
+# ---------------------------
+# Exports stream straight from an SQLite cursor in EXPORT_BATCH_SIZE chunks, so memory
+# stays flat regardless of how many rows match. Filters: ?start=&end= (YYYY-MM-DD),
+# ?format=csv|ndjson, and ?user_id= on the admin variants. Archived years in the range are
+# streamed first, from their archive files, followed by the rows still in the hot tables.
+EXPORTS = {
+    "time_logs": (
+        ["user_id", "username", "date", "check_in", "check_out", "flex_time", "day_minutes", "day_flex"],
+        """
+        SELECT t.user_id, u.username, t.date, t.check_in, t.check_out, t.flex_time,
+               s.minutes, s.minutes - cal.baseline_minutes
+        FROM {db}.time_logs t
+        JOIN main.users u ON u.id = t.user_id
+        LEFT JOIN {db}.daily_summary s ON s.user_id = t.user_id AND s.date = t.date
+        LEFT JOIN main.calendar cal ON cal.date = t.date
+        WHERE t.date BETWEEN ? AND ? {user_filter}
+        ORDER BY t.user_id, t.date, t.check_in
+        """,
+    ),
+    "diary": (
+        ["user_id", "username", "date", "time_log_id", "timestamp", "end_time", "note"],
+        """
+        SELECT t.user_id, u.username, t.date, d.time_log_id, d.timestamp, d.end_time, d.note
+        FROM {db}.time_logs t
+        JOIN {db}.diary d ON d.time_log_id = t.id
+        JOIN main.users u ON u.id = t.user_id
+        WHERE t.date BETWEEN ? AND ? {user_filter}
+        ORDER BY t.user_id, t.date, t.check_in, d.timestamp
+        """,
+    ),
+}
+
+def _export_response(kind, user_id, redirect_to):
+    columns, sql = EXPORTS[kind]
+    fmt = request.args.get("format", "csv")
+    start = request.args.get("start") or "0000-01-01"
+    end = request.args.get("end") or "9999-12-31"
+    if fmt not in ("csv", "ndjson"):
+        flash("Export format must be csv or ndjson.")
+        return redirect(url_for(redirect_to))
+    for value in (request.args.get("start"), request.args.get("end")):
+        if value and _iso_week_of(value) is None:
+            flash("Export dates must be in YYYY-MM-DD format.")
+            return redirect(url_for(redirect_to))
+    params = [start, end]
+    user_filter = ""
+    if user_id is not None:
+        user_filter = "AND t.user_id = ?"
+        params.append(user_id)
+
+    def stream_rows(c, db):
+        c.execute(sql.format(db=db, user_filter=user_filter), params)
+        while True:
+            rows = c.fetchmany(app.config["EXPORT_BATCH_SIZE"])
+            if not rows:
+                break
+            yield rows
+
+    def sources(conn):
+        for db in archive_sources(conn, start, end):
+            c = conn.cursor()
+            try:
+                yield from stream_rows(c, db)
+            finally:
+                c.close()
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            writer.writerow(columns)
+        for rows in sources(get_db()):
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(columns, row))))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"{kind}_{start}_{end}.{fmt}".replace("0000-01-01", "start").replace("9999-12-31", "end")
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route("/export/time_logs")
+@login_required
+def export_time_logs():
+    return _export_response("time_logs", session["user_id"], "index")
+
+@app.route("/export/diary")
+@login_required
+def export_diary():
+    return _export_response("diary", session["user_id"], "index")
+
+@app.route("/admin/export/time_logs")
+@login_required
+@admin_required
+def admin_export_time_logs():
+    return _export_response("time_logs", request.args.get("user_id", type=int), "admin")
+
+@app.route("/admin/export/diary")
+@login_required
+@admin_required
+def admin_export_diary():
+    return _export_response("diary", request.args.get("user_id", type=int), "admin")
+
+# ---------------------------
+# Bulk Import
+# ---------------------------
+# Records are dicts with date, check_in, check_out and optionally key, note/note_time
+# (CSV) or notes: [{timestamp, note, end_time}] (JSON). The key defaults to the session
+# itself, so importing the same file twice never creates duplicates.
+def _parse_import_record(record):
+    """Validates one import record. Returns (date, check_in, check_out, minutes, key, notes) or raises ValueError."""
+    date = (record.get("date") or "").strip()
+    check_in = (record.get("check_in") or "").strip()
+    check_out = (record.get("check_out") or "").strip()
+    if _iso_week_of(date) is None:
+        raise ValueError("date must be YYYY-MM-DD")
+    if _minutes_since_midnight(check_in) is None or _minutes_since_midnight(check_out) is None:
+        raise ValueError("check_in and check_out must be HH:MM")
+    minutes = calculate_flex_time(date, check_in, None, None, check_out)
+    key = str(record.get("key") or record.get("import_key") or f"{date} {check_in}-{check_out}")
+    notes = []
+    for note in record.get("notes") or []:
+        if not note.get("note"):
+            raise ValueError("diary notes need a note")
+        timestamp = note.get("timestamp") or check_in
+        if _minutes_since_midnight(timestamp) is None:
+            raise ValueError("diary timestamp must be HH:MM")
+        end_time = note.get("end_time") or None
+        if end_time is not None and _minutes_since_midnight(end_time) is None:
+            raise ValueError("diary end_time must be HH:MM")
+        notes.append((timestamp, end_time, note["note"]))
+    if record.get("note"):
+        note_time = record.get("note_time") or check_in
+        if _minutes_since_midnight(note_time) is None:
+            raise ValueError("note_time must be HH:MM")
+        notes.append((note_time, None, record["note"]))
+    return date, check_in, check_out, minutes, key, notes
+
+def import_time_logs(conn, user_id, records, progress=None):
+    """
+    Imports sessions (and their diary notes) for one user in IMPORT_CHUNK_SIZE transactions.
+    Each chunk is a single executemany into time_logs; rows whose import key already exists
+    are counted as duplicates. The flex rollups for all touched days are refreshed at the
+    end, JOB_BATCH_SIZE days per transaction. progress(report) is called before each chunk commits. Returns a report of
+    accepted, duplicate and rejected rows.
+    """
+    chunk_size = app.config["IMPORT_CHUNK_SIZE"]
+    max_reported = app.config["IMPORT_MAX_REPORTED_ERRORS"]
+    report = {"accepted": 0, "duplicates": 0, "notes": 0, "rejected_count": 0, "rejected": []}
+    touched_dates = set()
+    c = conn.cursor()
+
+    def flush(chunk):
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM time_logs")
+        last_id = c.fetchone()[0]
+        c.executemany("INSERT OR IGNORE INTO time_logs (date, check_in, check_out, flex_time, user_id, import_key, "
+                      "start_min, end_min) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                      [(date, check_in, check_out, minutes, user_id, key) + session_columns(date, check_in, check_out)
+                       for date, check_in, check_out, minutes, key, _ in chunk])
+        # A rowid range scan; filtering on user_id in SQL would walk the user's whole history instead.
+        c.execute("SELECT id, import_key, user_id FROM time_logs WHERE id > ?", (last_id,))
+        inserted = dict((key, log_id) for log_id, key, owner in c.fetchall() if owner == user_id)
+        notes = []
+        for date, _, _, _, key, record_notes in chunk:
+            log_id = inserted.pop(key, None)
+            if log_id is None:
+                report["duplicates"] += 1
+                continue
+            report["accepted"] += 1
+            touched_dates.add(date)
+            notes.extend((log_id, timestamp, end_time, note, user_id) for timestamp, end_time, note in record_notes)
+        c.executemany("INSERT INTO diary (time_log_id, timestamp, end_time, note, user_id) VALUES (?, ?, ?, ?, ?)",
+                      notes)
+        report["notes"] += len(notes)
+        if progress:
+            progress(report)
+        conn.commit()
+
+    try:
+        chunk = []
+        for row_number, record in enumerate(records, start=1):
+            try:
+                chunk.append(_parse_import_record(record))
+            except (ValueError, AttributeError, TypeError) as exc:
+                report["rejected_count"] += 1
+                if len(report["rejected"]) < max_reported:
+                    report["rejected"].append({"row": row_number, "error": str(exc)})
+                continue
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    finally:
+        # Also runs if the input breaks half way, so committed chunks are never left out of the rollups.
+        if conn.in_transaction:
+            conn.rollback()
+        dates = sorted(touched_dates)
+        batch_size = app.config["JOB_BATCH_SIZE"]
+        for start in range(0, len(dates), batch_size):
+            batch = dates[start:start + batch_size]
+            refresh_rollup_range(c, user_id, batch[0], batch[-1])
+            bump_data_version(c, user_id)
+            conn.commit()
+            time.sleep(app.config["JOB_BATCH_PAUSE_MS"] / 1000)
+    return report
+
+def read_import_records(stream, filename):
+    """Yields import records from a CSV, NDJSON or JSON-array text stream, chosen by file extension."""
+    if filename.endswith(".csv"):
+        yield from csv.DictReader(stream)
+    elif filename.endswith(".ndjson") or filename.endswith(".jsonl"):
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from json.load(stream)
+
+@job_handler("import_time_logs", resumable=True)
+def import_job(job, conn, params):
+    """Imports a staged upload; rerunning it is safe because already-imported keys are skipped."""
+    def progress(report):
+        job.progress(report["accepted"] + report["duplicates"] + report["rejected_count"])
+
+    try:
+        with open(params["path"], newline="", encoding="utf-8") as stream:
+            return import_time_logs(conn, params["user_id"], read_import_records(stream, params["filename"]),
+                                    progress)
+    except (ValueError, csv.Error) as exc:
+        raise ValueError(f"Could not read import file: {exc}")
+    finally:
+        if os.path.exists(params["path"]):
+            os.remove(params["path"])
+
+@app.route("/import", methods=["GET", "POST"])
+@login_required
+def import_logs():
+    """
+    Stages the upload (a file, or a JSON array in the body) and imports it in a background
+    job. JSON callers get 202 with the job's status URL; form posts are sent to the job page.
+    """
+    if request.method == "POST":
+        if request.is_json:
+            records = request.get_json()
+            if not isinstance(records, list):
+                return jsonify({"error": "Expected a JSON array of records."}), 400
+            filename = "upload.json"
+        elif "file" in request.files and request.files["file"].filename:
+            upload = request.files["file"]
+            filename = upload.filename.lower()
+        else:
+            flash("Choose a CSV or JSON file to import.")
+            return redirect(url_for("import_logs"))
+        fd, path = tempfile.mkstemp(prefix="import-", suffix=os.path.splitext(filename)[1],
+                                    dir=app.config["JOB_UPLOAD_DIR"])
+        with os.fdopen(fd, "wb") as staged:
+            if request.is_json:
+                staged.write(json.dumps(records).encode("utf-8"))
+            else:
+                upload.save(staged)
+        job_id = enqueue_job(get_db(), "import_time_logs",
+                             {"user_id": session["user_id"], "path": path, "filename": filename},
+                             created_by=session["user_id"])
+        if request.is_json:
+            return jsonify({"job_id": job_id, "status_url": url_for("job_status", job_id=job_id)}), 202
+        return redirect(url_for("job_status", job_id=job_id))
+    return render_template("import.html")
+
+# ---------------------------
+# Year Archival
+# ---------------------------
+# Closed years can be moved out of the hot tables into ARCHIVE_DIR/time_manager_YYYY.db,
+# one file per year holding its time_logs, diary and daily_summary rows. Each user's
+# minutes, days and flex for the year stay behind in flex_carryover, so the dashboard,
+# summary and team overview never open an archive. Exports, the diary page, the diary
+# report and diary analytics ATTACH archive files read-only, one at a time, when their
+# date range reaches an archived year. Diary search and /api/logs cover the hot tables only.
+def archive_path(year):
+    return os.path.join(app.config["ARCHIVE_DIR"], f"time_manager_{year}.db")
+
+@contextmanager
+def attached_archive(conn, path, alias="archive", readonly=True):
+    """ATTACHes an archive file to conn for the duration of the block."""
+    target = os.path.abspath(path)
+    if readonly:
+        target = "file:" + urllib.parse.quote(target) + "?mode=ro"
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (target,))
+    try:
+        yield alias
+    finally:
+        conn.execute(f"DETACH DATABASE {alias}")
+
+def archived_years_between(c, start, end):
+    """Returns [(year, path)] for archived years that overlap the YYYY-MM-DD range."""
+    c.execute("SELECT year, path FROM archived_years WHERE year BETWEEN ? AND ? ORDER BY year",
+              (int(start[:4]), int(end[:4])))
+    return c.fetchall()
+
+def archive_sources(conn, start="0000-01-01", end="9999-12-31", newest_first=False):
+    """
+    Yields the schema name of every database holding rows in the YYYY-MM-DD range: each
+    archived year's alias, attached read-only only while the caller reads from it, and "main".
+    Archives come before "main" unless newest_first. Missing archive files are logged and skipped.
+    """
+    years = archived_years_between(conn.cursor(), start, end)
+    if newest_first:
+        yield "main"
+        years.reverse()
+    for year, path in years:
+        if not os.path.exists(path):
+            app.logger.warning("Archive for %s is missing at %s; skipped", year, path)
+            continue
+        with attached_archive(conn, path) as db:
+            yield db
+    if not newest_first:
+        yield "main"
+
+def archive_year(conn, year, job=None):
+    """
+    Moves every session dated in `year`, with its diary entries and daily rollups, into the
+    year's archive file and records what each user carries over in flex_carryover.
+    The year is copied in one transaction that only reads main. The hot-side deletes then run JOB_BATCH_SIZE
+    sessions per transaction, and each user's rollups are swapped for their carryover in a
+    transaction of their own, so check-ins get the write lock between batches. Each batch
+    re-copies its sessions before deleting them, which keeps edits made since the copy and
+    makes a pass that stopped part-way safe to run again. The archived_years row is committed
+    last. A failed copy removes the half-written archive file. Returns a dict with the path
+    and row counts.
+    """
+    if year >= datetime.now().year:
+        raise ValueError(f"{year} is not closed yet; only earlier years can be archived.")
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM archived_years WHERE year=?", (year,))
+    if c.fetchone():
+        raise ValueError(f"{year} is already archived.")
+    path = archive_path(year)
+    resuming = os.path.exists(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    first, last = f"{year:04d}-01-01", f"{year:04d}-12-31"
+    batch_size = app.config["JOB_BATCH_SIZE"]
+
+    def checkpoint(done, total=None):
+        if job:
+            job.checkpoint(done, total)
+        else:
+            conn.commit()
+            time.sleep(app.config["JOB_BATCH_PAUSE_MS"] / 1000)
+
+    copied = False
+    try:
+        with attached_archive(conn, path, readonly=False):
+            try:
+                if resuming:
+                    c.execute("SELECT 1 FROM archive.sqlite_master WHERE name='time_logs'")
+                    if not c.fetchone():
+                        raise ValueError(f"{path} already exists; move it aside before archiving {year}.")
+                else:
+                    # Deferred, so only the archive file is locked for writing; main is only read.
+                    c.execute("BEGIN")
+                    c.execute("CREATE TABLE archive.time_logs AS SELECT * FROM main.time_logs "
+                              "WHERE date BETWEEN ? AND ?", (first, last))
+                    c.execute("CREATE TABLE archive.diary AS SELECT d.* FROM main.diary d "
+                              "JOIN archive.time_logs t ON t.id = d.time_log_id")
+                    c.execute("CREATE TABLE archive.daily_summary AS SELECT * FROM main.daily_summary "
+                              "WHERE date BETWEEN ? AND ?", (first, last))
+                    c.execute("CREATE UNIQUE INDEX archive.idx_time_logs_id ON time_logs (id)")
+                    c.execute("CREATE INDEX archive.idx_time_logs_user_date ON time_logs (user_id, date, check_in)")
+                    c.execute("CREATE INDEX archive.idx_diary_time_log ON diary (time_log_id, timestamp)")
+                    c.execute("CREATE INDEX archive.idx_daily_summary_user_date ON daily_summary (user_id, date)")
+                    conn.commit()
+                copied = True
+                c.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM archive.time_logs")
+                sessions, users = c.fetchone()
+                done = 0
+                checkpoint(done, sessions + users)
+                last_id = 0
+                while True:
+                    c.execute("SELECT id FROM archive.time_logs WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size))
+                    ids = [row[0] for row in c.fetchall()]
+                    if not ids:
+                        break
+                    last_id = ids[-1]
+                    c.execute("BEGIN IMMEDIATE")
+                    c.execute(f"SELECT id FROM main.time_logs WHERE id IN ({','.join('?' * len(ids))})", ids)
+                    pending = [row[0] for row in c.fetchall()]  # the rest were moved by an earlier pass
+                    if pending:
+                        placeholders = ",".join("?" * len(pending))
+                        batch = f"SELECT id FROM archive.time_logs WHERE id IN ({placeholders})"
+                        c.execute(f"DELETE FROM archive.diary WHERE time_log_id IN ({placeholders})", pending)
+                        c.execute(f"DELETE FROM archive.time_logs WHERE id IN ({placeholders})", pending)
+                        # Sessions edited out of the year since the copy stay in the hot tables.
+                        c.execute(f"INSERT INTO archive.time_logs SELECT * FROM main.time_logs "
+                                  f"WHERE id IN ({placeholders}) AND date BETWEEN ? AND ?", pending + [first, last])
+                        c.execute(f"INSERT INTO archive.diary SELECT * FROM main.diary WHERE time_log_id IN ({batch})",
+                                  pending)
+                        c.execute(f"DELETE FROM main.diary WHERE time_log_id IN ({batch})", pending)
+                        c.execute(f"DELETE FROM main.time_logs WHERE id IN ({batch})", pending)
+                    done += len(ids)
+                    checkpoint(done)
+                # The copied daily rollups are re-summed from the sessions as they were moved.
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("DELETE FROM archive.daily_summary")
+                c.execute("INSERT INTO archive.daily_summary (user_id, date, minutes, sessions) "
+                          "SELECT user_id, date, SUM(end_min - start_min), COUNT(*) FROM archive.time_logs "
+                          "WHERE end_min IS NOT NULL GROUP BY user_id, date")
+                conn.commit()
+                c.execute("SELECT DISTINCT user_id FROM archive.time_logs")
+                user_ids = [row[0] for row in c.fetchall()]
+                for user_id in user_ids:
+                    c.execute("BEGIN IMMEDIATE")
+                    c.execute("""
+                        INSERT OR REPLACE INTO main.flex_carryover (user_id, year, minutes, days, flex)
+                        SELECT s.user_id, ?, SUM(s.minutes), COUNT(*), SUM(s.minutes - cal.baseline_minutes)
+                        FROM archive.daily_summary s
+                        JOIN main.calendar cal ON cal.date = s.date
+                        WHERE s.user_id=?
+                        GROUP BY s.user_id
+                    """, (year, user_id))
+                    c.execute("DELETE FROM main.daily_summary WHERE user_id=? AND date BETWEEN ? AND ?",
+                              (user_id, first, last))
+                    c.execute("DELETE FROM main.weekly_summary WHERE user_id=? AND iso_year=?", (user_id, year))
+                    # Re-sums the weeks that straddle New Year from the days still in the hot tables.
+                    refresh_rollups(c, user_id, [first, last])
+                    bump_data_version(c, user_id)
+                    done += 1
+                    checkpoint(done)
+                c.execute("SELECT (SELECT COUNT(*) FROM archive.time_logs), (SELECT COUNT(*) FROM archive.diary)")
+                logs, diary = c.fetchone()
+                c.execute("INSERT INTO archived_years (year, path, time_logs, diary, archived_at) "
+                          "VALUES (?, ?, ?, ?, ?)",
+                          (year, path, logs, diary, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    except Exception:
+        if not copied and not resuming and os.path.exists(path):
+            os.remove(path)
+        raise
+    return {"year": year, "path": path, "time_logs": logs, "diary": diary, "users": len(user_ids)}
+
+def purge_archived_user(conn, user_id):
+    """
+    Deletes a removed user's sessions, diary entries and daily rollups from every archive
+    file, JOB_BATCH_SIZE sessions per transaction, and updates the archived_years counts.
+    Only the archive file is written until the counts are stored. Returns the rows deleted.
+    """
+    c = conn.cursor()
+    batch_size = app.config["JOB_BATCH_SIZE"]
+    deleted = 0
+    c.execute("SELECT year, path FROM archived_years ORDER BY year")
+    for year, path in c.fetchall():
+        if not os.path.exists(path):
+            app.logger.warning("Archive for %s is missing at %s; user %s not purged from it", year, path, user_id)
+            continue
+        with attached_archive(conn, path, readonly=False):
+            try:
+                while True:
+                    c.execute("SELECT id FROM archive.time_logs WHERE user_id=? LIMIT ?", (user_id, batch_size))
+                    ids = [row[0] for row in c.fetchall()]
+                    if not ids:
+                        break
+                    placeholders = ",".join("?" * len(ids))
+                    c.execute(f"DELETE FROM archive.diary WHERE time_log_id IN ({placeholders})", ids)
+                    deleted += c.rowcount
+                    c.execute(f"DELETE FROM archive.time_logs WHERE id IN ({placeholders})", ids)
+                    deleted += c.rowcount
+                    conn.commit()
+                    time.sleep(app.config["JOB_BATCH_PAUSE_MS"] / 1000)
+                c.execute("DELETE FROM archive.daily_summary WHERE user_id=?", (user_id,))
+                conn.commit()
+                c.execute("SELECT (SELECT COUNT(*) FROM archive.time_logs), (SELECT COUNT(*) FROM archive.diary)")
+                logs, diary = c.fetchone()
+                c.execute("UPDATE archived_years SET time_logs=?, diary=? WHERE year=?", (logs, diary, year))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    return deleted
+
+def verify_archive(conn, year):
+    """
+    Checks an archived year: the file opens read-only, its row counts match what was
+    recorded, and flex_carryover matches a recompute from the archived sessions.
+    Returns a list of problem descriptions.
+    """
+    c = conn.cursor()
+    c.execute("SELECT path, time_logs, diary FROM archived_years WHERE year=?", (year,))
+    row = c.fetchone()
+    if not row:
+        return [f"{year} is not archived."]
+    path, logs, diary = row
+    if not os.path.exists(path):
+        return [f"{year}: archive file {path} is missing."]
+    problems = []
+    with attached_archive(conn, path):
+        c.execute("SELECT (SELECT COUNT(*) FROM archive.time_logs), (SELECT COUNT(*) FROM archive.diary)")
+        have = c.fetchone()
+        if tuple(have) != (logs, diary):
+            problems.append(f"{year}: archive holds {have[0]} sessions and {have[1]} diary entries, "
+                            f"expected {logs} and {diary}")
+        # Accounts deleted before their archived rows were purged keep those rows but no carryover.
+        c.execute("""
+            SELECT t.user_id, SUM(t.minutes), COUNT(*), SUM(t.minutes - cal.baseline_minutes)
+            FROM (SELECT user_id, date, SUM(end_min - start_min) AS minutes
+                  FROM archive.time_logs
+                  WHERE end_min IS NOT NULL AND user_id IN (SELECT id FROM main.users)
+                  GROUP BY user_id, date) t
+            JOIN main.calendar cal ON cal.date = t.date
+            GROUP BY t.user_id
+        """)
+        expected = {row[0]: tuple(row[1:]) for row in c.fetchall()}
+    c.execute("SELECT user_id, minutes, days, flex FROM flex_carryover WHERE year=?", (year,))
+    stored = {row[0]: tuple(row[1:]) for row in c.fetchall()}
+    for uid in expected.keys() | stored.keys():
+        if expected.get(uid) != stored.get(uid):
+            problems.append(f"{year}: user {uid} carryover expected {expected.get(uid)}, stored {stored.get(uid)}")
+    return problems
+
+@job_handler("archive_year", resumable=True)
+def archive_year_job(job, conn, params):
+    report = archive_year(conn, params["year"], job)
+    report["problems"] = verify_archive(conn, params["year"])
+    return report
+
+@app.route("/admin/archive", methods=["GET", "POST"])
+@login_required
+@admin_required
+def admin_archive():
+    conn = get_db()
+    c = conn.cursor()
+    if request.method == "POST":
+        try:
+            year = int(request.form.get("year", ""))
+        except ValueError:
+            flash("Enter a year to archive.")
+            return redirect(url_for("admin_archive"))
+        if request.form.get("action") == "verify":
+            problems = verify_archive(conn, year)
+            flash(f"{year}: archive verified." if not problems else "; ".join(problems[:20]))
+            return redirect(url_for("admin_archive"))
+        job_id = enqueue_job(conn, "archive_year", {"year": year}, created_by=session["user_id"])
+        return redirect(url_for("job_status", job_id=job_id))
+    c.execute("""
+        SELECT a.year, a.path, a.time_logs, a.diary, a.archived_at, COALESCE(SUM(f.flex), 0)
+        FROM archived_years a
+        LEFT JOIN flex_carryover f ON f.year = a.year
+        GROUP BY a.year
+        ORDER BY a.year
+    """)
+    years = c.fetchall()
+    return render_template("admin_archive.html", years=years, current_year=datetime.now().year)
+
+# ---------------------------
+# Open Session Sweeper
+# ---------------------------
+# toggle_check() only closes today's session, so one that is never checked out stays open
+# for good. The sweeper closes sessions that have been open for SWEEP_STALE_AFTER_MINUTES
+# (long enough to leave night shifts alone) and ends diary entries still running on closed
+# sessions. Run it with `flask sweep-sessions` from cron, from /admin/jobs, or every
+# SWEEP_INTERVAL_SECONDS in-process.
+SWEEP_POLICIES = {
+    "baseline": lambda start_min: start_min + app.config["WORKDAY_BASELINE_MINUTES"],  # a standard day
+    "check_in": lambda start_min: start_min,                             # zero minutes, left for correction
+    "end_of_day": lambda start_min: start_min - start_min % 1440 + 1439,  # 23:59 on the check-in day
+}
+
+def sweep_open_sessions(conn, now=None):
+    """
+    Closes forgotten sessions according to SWEEP_POLICY, at most JOB_BATCH_SIZE per short
+    write transaction, recomputing their flex_time and rollups. Returns a report of the
+    sessions closed and the diary entries ended.
+    """
+    now = now or datetime.now()
+    now_min = session_columns(now.strftime("%Y-%m-%d"), now.strftime("%H:%M"), None)[0]
+    cutoff = now_min - app.config["SWEEP_STALE_AFTER_MINUTES"]
+    close_at = SWEEP_POLICIES[app.config["SWEEP_POLICY"]]
+    batch_size = app.config["JOB_BATCH_SIZE"]
+    report = {"policy": app.config["SWEEP_POLICY"], "sessions": 0, "diary": 0, "closed": []}
+    c = conn.cursor()
+    while True:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT id, user_id, date, check_in, start_min FROM time_logs "
+                  "WHERE check_out IS NULL AND start_min < ? ORDER BY start_min LIMIT ?", (cutoff, batch_size))
+        rows = c.fetchall()
+        updates = []
+        touched = {}
+        for log_id, user_id, date, check_in, start_min in rows:
+            end_min = min(close_at(start_min), now_min)
+            check_out = f"{end_min % 1440 // 60:02d}:{end_min % 60:02d}"
+            updates.append((check_out, end_min - start_min, end_min, log_id))
+            touched.setdefault(user_id, set()).add(date)
+            if len(report["closed"]) < 100:
+                report["closed"].append({"id": log_id, "user_id": user_id, "date": date,
+                                         "check_in": check_in, "check_out": check_out})
+        c.executemany("UPDATE time_logs SET check_out=?, flex_time=?, end_min=? WHERE id=?", updates)
+        # Diary entries still running on a session that has ended, including ones closed above.
+        c.execute("""
+            SELECT d.id, d.user_id, t.check_out
+            FROM diary d
+            JOIN time_logs t ON t.id = d.time_log_id
+            WHERE d.end_time IS NULL AND t.check_out IS NOT NULL AND t.start_min < ?
+            LIMIT ?
+        """, (cutoff, batch_size))
+        diary = c.fetchall()
+        c.executemany("UPDATE diary SET end_time=? WHERE id=?", [(end, diary_id) for diary_id, _, end in diary])
+        for _, user_id, _ in diary:
+            touched.setdefault(user_id, set())
+        for user_id, dates in touched.items():
+            refresh_rollups(c, user_id, dates)
+            bump_data_version(c, user_id)
+        conn.commit()
+        report["sessions"] += len(rows)
+        report["diary"] += len(diary)
+        if len(rows) < batch_size and len(diary) < batch_size:
+            break
+        time.sleep(app.config["JOB_BATCH_PAUSE_MS"] / 1000)
+    return report
+
+@job_handler("sweep_open_sessions", resumable=True)
+def sweep_job(job, conn, params):
+    return sweep_open_sessions(conn)
+
+_sweeper_started = False
+
+def start_session_sweeper():
+    """Starts the in-process sweeper thread once, if SWEEP_INTERVAL_SECONDS is set."""
+    global _sweeper_started
+    interval = app.config["SWEEP_INTERVAL_SECONDS"]
+    with _job_lock:
+        if _sweeper_started or not interval:
+            return
+        _sweeper_started = True
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context(), db_connection() as conn:
+                    report = sweep_open_sessions(conn)
+                if report["sessions"] or report["diary"]:
+                    app.logger.info("Sweeper closed %d session(s) and %d diary entr(ies)",
+                                    report["sessions"], report["diary"])
+            except Exception:
+                app.logger.exception("Open session sweep failed")
+
+    threading.Thread(target=loop, name="session-sweeper", daemon=True).start()
+
 # ---------------------------
 # Temporary Route to Reset the Database (Remove in Production)
 # ---------------------------
 @app.route("/reset_db")
 def reset_db():
-    db_path = "time_manager.db"
+    db_path = app.config["DATABASE"]
     if os.path.exists(db_path):
-        os.remove(db_path)
+        close_pool()
+        login_sessions.clear()
+        for path in (db_path, db_path + "-wal", db_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
         init_db()
         flash("Database has been reset!")
     else:
         flash("Database file not found!")
     return redirect(url_for("index"))
 
-if __name__ == "__main__":
+# ---------------------------
+# CLI Commands
+# ---------------------------
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations to the configured database."""
+    with db_connection() as conn:
+        _create_schema(conn)
+        applied = migrate_db(conn)
+        _ensure_admin(conn)
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+@app.cli.command("import-logs")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--user", "username", required=True, help="Username the sessions belong to.")
+def import_logs_command(path, username):
+    """Bulk-import sessions and diary notes from a CSV, NDJSON or JSON file."""
+    with db_connection() as conn:
+        row = conn.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
+        if not row:
+            raise click.ClickException(f"No such user: {username}")
+        with open(path, newline="", encoding="utf-8") as stream:
+            report = import_time_logs(conn, row[0], read_import_records(stream, path.lower()))
+    print(json.dumps(report, indent=2))
+
+@app.cli.command("rebuild-summaries")
+@click.option("--check", is_flag=True, help="Only compare the rollups with a full recompute.")
+def rebuild_summaries_command(check):
+    """Rebuild the daily/weekly flex rollups and verify them against a full recompute."""
+    with db_connection() as conn:
+        c = conn.cursor()
+        if not check:
+            rebuild_rollups(c)
+            conn.commit()
+        problems = verify_rollups(c)
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} rollup row(s) differ from a full recompute.")
+        raise SystemExit(1)
+    print("Rollups match a full recompute.")
+
+@app.cli.command("rebuild-calendar")
+def rebuild_calendar_command():
+    """Rewrite the calendar after changing HOLIDAYS or WORKDAY_BASELINE_MINUTES, then rebuild the rollups."""
+    calendar_day.cache_clear()
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        years = _data_years(c, "calendar")
+        fill_calendar(c, years)
+        rebuild_rollups(c)
+        c.execute("UPDATE users SET data_version = data_version + 1")
+        conn.commit()
+    print(f"Calendar rewritten for {len(years)} year(s); rollups rebuilt. "
+          "Flex carried over from archived years is unchanged.")
+
+@app.cli.command("archive-year")
+@click.argument("year", type=int)
+@click.option("--verify", "verify_only", is_flag=True, help="Only verify an existing archive.")
+def archive_year_command(year, verify_only):
+    """Move a closed year of sessions and diary entries into its own archive file."""
+    with db_connection() as conn:
+        if not verify_only:
+            try:
+                report = archive_year(conn, year)
+            except ValueError as exc:
+                raise click.ClickException(str(exc))
+            print(json.dumps(report, indent=2))
+        problems = verify_archive(conn, year) + verify_rollups(conn.cursor())
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} problem(s) found after archiving {year}.")
+        raise SystemExit(1)
+    print(f"Archive for {year} verified; rollups match a full recompute.")
+
+@app.cli.command("sweep-sessions")
+def sweep_sessions_command():
+    """Close forgotten open sessions and diary entries (suitable for cron)."""
+    with db_connection() as conn:
+        report = sweep_open_sessions(conn)
+    print(json.dumps(report, indent=2))
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """
+    Exercises the user-facing routes against a scratch database and runs
+    EXPLAIN QUERY PLAN on every statement they issue against time_logs/diary.
+    Exits non-zero if any of them falls back to a full scan.
+    """
+    saved = {key: app.config[key] for key in ("DATABASE", "DB_POOL_SIZE", "JOBS_EAGER")}
+    statements = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Jobs run inline on the traced connection, so their batched statements are checked too.
+        app.config.update(DATABASE=os.path.join(tmp, "plans.db"), DB_POOL_SIZE=1, JOBS_EAGER=True)
+        try:
+            init_db()
+            # Test-client requests share the CLI's app context, so they all run on this connection.
+            conn = get_db()
+            conn.set_trace_callback(statements.append)
+            client = app.test_client()
+            today = datetime.now().strftime("%Y-%m-%d")
+            client.post("/register", data={"username": "planner", "password": "planner"})
+            client.post("/login", data={"username": "planner", "password": "planner"})
+            client.post("/toggle_check")
+            client.post("/diary/activate", data={"note": "Planning"})
+            client.post("/diary/deactivate")
+            client.post("/add_diary", data={"note": "Note"})
+            client.post("/toggle_check")
+            client.post("/add_day", data={"date": today, "check_in": "08:00", "check_out": "16:00"})
+            client.post("/edit/2", data={"check_in": "08:30", "check_out": "16:30"})
+            client.post("/edit_diary/1", data={"timestamp": "09:00", "note": "Edited"})
+            for path in ("/", "/api/logs", "/edit/1", "/edit_diary/1", "/diary", "/diary_report",
+                         "/diary/analytics", "/summary"):
+                client.get(path)
+            client.post("/delete/2")
+            client.get("/logout")
+            client.post("/login", data={"username": "admin", "password": "Inova20!0"})
+            client.post("/admin/delete_user/2")
+            # A session forgotten two days ago, for the sweeper's queries.
+            stale_date = (datetime.now() - timedelta(days=2)).strftime("%Y-%m-%d")
+            c = conn.cursor()
+            c.execute("INSERT INTO time_logs (date, check_in, user_id, start_min, end_min) "
+                      "VALUES (?, '08:00', 1, ?, ?)", (stale_date,) + session_columns(stale_date, "08:00", None))
+            c.execute("INSERT INTO diary (time_log_id, timestamp, note, user_id) VALUES (?, '09:00', 'Stale', 1)",
+                      (c.lastrowid,))
+            conn.commit()
+            sweep_open_sessions(conn)
+
+            conn.set_trace_callback(None)
+            problems = []
+            seen = set()
+            for sql in statements:
+                normalized = " ".join(sql.split())
+                if normalized in seen or not normalized.upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                    continue
+                if "time_logs" not in normalized and "diary" not in normalized:
+                    continue
+                if "diary_fts_" in normalized:
+                    continue  # FTS5's own bookkeeping on its shadow tables
+                seen.add(normalized)
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+                scans = [step for step in plan if step.startswith("SCAN ") and "CONSTANT ROW" not in step]
+                print(("SCAN  " if scans else "ok    ") + normalized)
+                for step in plan:
+                    print("        " + step)
+                if scans:
+                    problems.append(normalized)
+        finally:
+            release_db(None)
+            close_pool()
+            app.config.update(saved)
+    if problems:
+        print(f"{len(problems)} statement(s) scan time_logs/diary without an index.")
+        raise SystemExit(1)
+    print("All route queries use an index.")
+
+# ---------------------------
+# Application Factory
+# ---------------------------
+def create_app(config=None):
+    """
+    Production entry point (see wsgi.py and gunicorn.conf.py). Applies `config` on top of the
+    TIME_MANAGER_* environment loaded at import, then creates or migrates the schema and
+    recovers unfinished jobs. Under gunicorn's preload_app this runs once in the master,
+    before the workers fork.
+    """
+    if config:
+        app.config.update(config)
+    if app.secret_key == "your_secret_key":
+        app.logger.warning("Using the built-in secret key; set TIME_MANAGER_SECRET_KEY in production.")
     init_db()
-    app.run(debug=True)
+    with db_connection() as conn:
+        recover_jobs(conn)
+    # SQLite connections must not cross a fork; every worker opens its own on first use.
+    close_pool()
+    return app
+
+if __name__ == "__main__":
+    # Development server. TIME_MANAGER_DEBUG=true turns on the debugger and reloader.
+    create_app().run()
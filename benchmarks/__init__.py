@@ -0,0 +1 @@
+"""Benchmarks for the Time Manager app. Run the modules with ``python -m benchmarks.<name>``."""
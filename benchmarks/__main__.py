@@ -0,0 +1,69 @@
+"""
+Runs the full benchmark suite and writes the results to JSON for comparison across commits.
+
+    python -m benchmarks --users 50 --years 3 --output results.json
+
+Generates a fresh database (unless --reuse is given), then runs the flex engine
+comparison, the microbenchmarks and the load driver.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks import flex, generate, load, micro
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--reuse", action="store_true", help="Use the existing --db instead of regenerating it.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--sessions", type=int, default=100_000, help="Sessions for the flex engine comparison.")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": vars(args),
+    }
+    if not args.reuse:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        started = time.perf_counter()
+        dataset = generate.generate(args.db, args.users, args.years)
+        results["dataset"] = dict(dataset["counts"], seconds=time.perf_counter() - started)
+        print(f"dataset: {results['dataset']}")
+    results["flex_engine"] = flex.run(args.sessions)
+    print(f"flex engine: {results['flex_engine']['speedup_warm']:.1f}x faster than legacy")
+    results["micro"] = micro.run(args.db)
+    for name, value in results["micro"].items():
+        print(f"micro {name}: {value['median_ms']:.2f} ms")
+    results["load"] = load.run(args.db, args.threads, args.seconds)
+    print(f"load: {results['load']['throughput_rps']:.0f} req/s, {results['load']['total_errors']} errors")
+
+    with open(args.output, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
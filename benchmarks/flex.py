@@ -0,0 +1,109 @@
+"""
+Compares calculate_daily_and_weekly_flex against the original strptime-per-row
+implementation on a synthetic set of sessions.
+
+    python -m benchmarks.flex --sessions 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, date
+
+from app import calculate_daily_and_weekly_flex, calendar_day, _minutes_since_midnight, _iso_week_of
+
+
+def legacy_calculate_daily_and_weekly_flex(logs):
+    """
+    The original implementation, kept as the baseline for comparison. Only its baselines and
+    week keys follow the calendar (per-day baseline, (iso_year, iso_week)), so both return the same.
+    """
+    daily_totals = {}
+    fmt = "%H:%M"
+    for log in logs:
+        date_str = log[1]
+        if not log[2] or not log[3]:
+            continue
+        try:
+            check_in = datetime.strptime(log[2].strip(), fmt)
+            check_out = datetime.strptime(log[3].strip(), fmt)
+        except ValueError:
+            continue
+        if check_out < check_in:
+            check_out += timedelta(days=1)
+        duration = (check_out - check_in).total_seconds() / 60
+        daily_totals[date_str] = daily_totals.get(date_str, 0) + duration
+
+    daily_flex = {}
+    weekly_hours = {}
+    weekly_flex = {}
+    total_flex = 0
+    for date_str, minutes in daily_totals.items():
+        day = calendar_day(date_str)
+        flex = minutes - day[6]
+        daily_flex[date_str] = flex
+        week = day[:2]
+        weekly_hours[week] = weekly_hours.get(week, 0) + minutes
+        weekly_flex[week] = weekly_flex.get(week, 0) + flex
+        total_flex += flex
+    return daily_totals, daily_flex, weekly_hours, weekly_flex, total_flex
+
+
+def make_sessions(count, seed=1):
+    """Returns `count` time_logs-shaped rows spread over several years, with some open and overnight sessions."""
+    rng = random.Random(seed)
+    start = date(2019, 1, 1)
+    rows = []
+    for i in range(count):
+        day = start + timedelta(days=rng.randrange(6 * 365))
+        check_in = rng.randrange(24 * 60)
+        check_out = (check_in + rng.randrange(30, 11 * 60)) % 1440
+        out_str = None if rng.random() < 0.01 else f"{check_out // 60:02d}:{check_out % 60:02d}"
+        rows.append((i, day.isoformat(), f"{check_in // 60:02d}:{check_in % 60:02d}", out_str, 0, 1))
+    return rows
+
+
+def best_of(fn, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(sessions=100_000, repeat=3):
+    rows = make_sessions(sessions)
+    expected = legacy_calculate_daily_and_weekly_flex(rows)
+    actual = calculate_daily_and_weekly_flex(rows)
+    if expected != actual:
+        raise AssertionError("calculate_daily_and_weekly_flex disagrees with the legacy implementation")
+    legacy = best_of(legacy_calculate_daily_and_weekly_flex, rows, repeat)
+    # Measure from a cold cache too, so the speedup isn't just warm lru_cache hits.
+    _minutes_since_midnight.cache_clear()
+    _iso_week_of.cache_clear()
+    cold = best_of(calculate_daily_and_weekly_flex, rows, 1)
+    warm = best_of(calculate_daily_and_weekly_flex, rows, repeat)
+    return {
+        "sessions": sessions,
+        "legacy_seconds": legacy,
+        "batch_cold_seconds": cold,
+        "batch_warm_seconds": warm,
+        "speedup_cold": legacy / cold,
+        "speedup_warm": legacy / warm,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    result = run(args.sessions, args.repeat)
+    print(f"{result['sessions']} sessions")
+    print(f"  legacy:      {result['legacy_seconds'] * 1000:8.1f} ms")
+    print(f"  batch cold:  {result['batch_cold_seconds'] * 1000:8.1f} ms  ({result['speedup_cold']:.1f}x)")
+    print(f"  batch warm:  {result['batch_warm_seconds'] * 1000:8.1f} ms  ({result['speedup_warm']:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Fills a Time Manager database with synthetic users, sessions and diary entries.
+
+    python -m benchmarks.generate --db bench.db --users 50 --years 3
+
+Each user works most weekdays, sometimes in two or three sessions, with occasional
+overnight shifts that cross midnight and diary notes attached to most sessions.
+Every user's password is their username.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import app as time_manager
+
+ACTIVITIES = ["Coding", "Code review", "Meetings", "Planning", "Support", "Documentation", "Testing",
+              "Deploy", "Customer call", "Training"]
+
+
+def _hhmm(minutes):
+    minutes %= 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _day_sessions(rng):
+    """Returns [(check_in, check_out, minutes), ...] for one worked day."""
+    if rng.random() < 0.03:
+        start = rng.randrange(20 * 60, 23 * 60)  # overnight shift
+        return [(start, start + rng.randrange(6 * 60, 9 * 60))]
+    start = rng.randrange(7 * 60, 9 * 60 + 30)
+    length = rng.randrange(7 * 60, 9 * 60 + 30)
+    if rng.random() < 0.35:
+        lunch = start + rng.randrange(3 * 60, 4 * 60 + 30)
+        back = lunch + rng.randrange(30, 60)
+        sessions = [(start, lunch), (back, start + length + (back - lunch))]
+        if rng.random() < 0.1:
+            evening = rng.randrange(19 * 60, 21 * 60)
+            sessions.append((evening, evening + rng.randrange(30, 120)))
+        return sessions
+    return [(start, start + length)]
+
+
+def generate(db_path, users=50, years=3, seed=1, end=None):
+    """Populates db_path and returns a dict with row counts and the users created."""
+    rng = random.Random(seed)
+    time_manager.app.config["DATABASE"] = db_path
+    time_manager.init_db()
+    end = end or date.today()
+    start = end - timedelta(days=365 * years)
+    password_cache = {}
+    counts = {"users": 0, "time_logs": 0, "diary": 0}
+    usernames = []
+    with time_manager.db_connection() as conn:
+        c = conn.cursor()
+        for n in range(users):
+            username = f"user{n:05d}"
+            if username not in password_cache:
+                # A deliberately cheap hash; generating thousands of users shouldn't take minutes.
+                password_cache[username] = generate_password_hash(username, method="pbkdf2:sha256:1000")
+            c.execute("INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
+                      (username, password_cache[username]))
+            c.execute("SELECT id FROM users WHERE username=?", (username,))
+            user_id = c.fetchone()[0]
+            usernames.append(username)
+            logs = []
+            day = start
+            while day <= end:
+                if day.weekday() < 5 and rng.random() < 0.92 or day.weekday() >= 5 and rng.random() < 0.04:
+                    for check_in, check_out in _day_sessions(rng):
+                        date_str, check_in_str, check_out_str = day.isoformat(), _hhmm(check_in), _hhmm(check_out)
+                        logs.append((date_str, check_in_str, check_out_str, check_out - check_in, user_id)
+                                    + time_manager.session_columns(date_str, check_in_str, check_out_str))
+                day += timedelta(days=1)
+            c.executemany("INSERT INTO time_logs (date, check_in, check_out, flex_time, user_id, "
+                          "start_min, end_min) VALUES (?, ?, ?, ?, ?, ?, ?)", logs)
+            c.execute("SELECT id, check_in, flex_time FROM time_logs WHERE user_id=?", (user_id,))
+            diary = []
+            for log_id, check_in, minutes in c.fetchall():
+                offset = time_manager._minutes_since_midnight(check_in)
+                for _ in range(rng.choice((0, 1, 1, 2, 3))):
+                    begin = offset + rng.randrange(0, max(int(minutes), 1))
+                    finish = _hhmm(begin + rng.randrange(15, 180)) if rng.random() < 0.9 else None
+                    diary.append((log_id, _hhmm(begin), finish, rng.choice(ACTIVITIES), user_id))
+            c.executemany("INSERT INTO diary (time_log_id, timestamp, end_time, note, user_id) "
+                          "VALUES (?, ?, ?, ?, ?)", diary)
+            time_manager.rebuild_rollups(c, user_id)
+            conn.commit()
+            counts["users"] += 1
+            counts["time_logs"] += len(logs)
+            counts["diary"] += len(diary)
+    return {"counts": counts, "usernames": usernames, "start": start.isoformat(), "end": end.isoformat()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    result = generate(args.db, args.users, args.years, args.seed)
+    counts = result["counts"]
+    print(f"Generated {counts['users']} users, {counts['time_logs']} sessions and {counts['diary']} "
+          f"diary entries in {time.perf_counter() - started:.1f}s -> {args.db}")
+
+
+if __name__ == "__main__":
+    main()
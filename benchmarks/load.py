@@ -0,0 +1,146 @@
+"""
+A load driver: worker threads log in as different users and hit the main pages for a
+fixed duration, either in-process through Flask's test client or over HTTP against a
+running server that uses the same database.
+
+    python -m benchmarks.load --db bench.db --threads 8 --seconds 10
+    python -m benchmarks.load --db bench.db --threads 16 --url http://127.0.0.1:8000
+    python -m benchmarks.load --db bench.db --threads 16 --scenario checkin --url http://127.0.0.1:8000
+"""
+import argparse
+import http.cookiejar
+import json
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import app as time_manager
+
+SCENARIO = [("GET", "/"), ("POST", "/toggle_check"), ("GET", "/summary"), ("GET", "/diary_report")]
+# Concurrent check-ins and check-outs only, for write throughput and lock errors.
+SCENARIOS = {"mixed": SCENARIO, "checkin": [("POST", "/toggle_check")]}
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _http_client(base_url):
+    """Returns open(method, path, data=None) -> status code, keeping cookies and not following redirects."""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                         _NoRedirect)
+
+    def open_(method, path, data=None):
+        body = urllib.parse.urlencode(data or {}).encode() if method == "POST" else None
+        try:
+            with opener.open(urllib.request.Request(base_url + path, data=body, method=method), timeout=60) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+    return open_
+
+
+def _test_client():
+    client = time_manager.app.test_client()
+    return lambda method, path, data=None: client.open(path, method=method, data=data).status_code
+
+
+def run(db_path, threads=8, seconds=10.0, scenario=SCENARIO, url=None):
+    if url:
+        conn = sqlite3.connect(db_path)
+    else:
+        time_manager.app.config.update(DATABASE=db_path, DB_POOL_SIZE=max(threads, 1))
+        time_manager.init_db()
+        conn = time_manager.get_pool().acquire()
+    try:
+        usernames = [row[0] for row in conn.execute(
+            "SELECT username FROM users WHERE username != 'admin' ORDER BY id LIMIT ?", (threads,))]
+    finally:
+        if url:
+            conn.close()
+        else:
+            time_manager.get_pool().release(conn)
+    if len(usernames) < threads:
+        raise SystemExit(f"Need at least {threads} generated users in {db_path}; run benchmarks.generate first.")
+
+    latencies = {path: [] for _, path in scenario}
+    errors = {path: 0 for _, path in scenario}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    start_barrier = threading.Barrier(threads)
+
+    def worker(username):
+        client = _http_client(url.rstrip("/")) if url else _test_client()
+        client("POST", "/login", {"username": username, "password": username})
+        local = {path: [] for _, path in scenario}
+        local_errors = {path: 0 for _, path in scenario}
+        start_barrier.wait()
+        while time.perf_counter() < deadline:
+            for method, path in scenario:
+                started = time.perf_counter()
+                try:
+                    ok = client(method, path) < 400
+                except Exception:
+                    ok = False
+                local[path].append(time.perf_counter() - started)
+                if not ok:
+                    local_errors[path] += 1
+        with lock:
+            for path in local:
+                latencies[path].extend(local[path])
+                errors[path] += local_errors[path]
+
+    workers = [threading.Thread(target=worker, args=(name,)) for name in usernames]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = {"target": url or "test_client", "threads": threads, "seconds": elapsed, "endpoints": {}}
+    total = 0
+    for path, values in latencies.items():
+        values.sort()
+        total += len(values)
+        results["endpoints"][path] = {
+            "requests": len(values),
+            "errors": errors[path],
+            "throughput_rps": len(values) / elapsed,
+            "p50_ms": _percentile(values, 0.50) * 1000 if values else None,
+            "p95_ms": _percentile(values, 0.95) * 1000 if values else None,
+            "p99_ms": _percentile(values, 0.99) * 1000 if values else None,
+        }
+    results["total_requests"] = total
+    results["total_errors"] = sum(errors.values())
+    results["throughput_rps"] = total / elapsed
+    if not url:
+        time_manager.close_pool()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--url", help="Drive a running server over HTTP instead of the test client.")
+    args = parser.parse_args()
+    print(json.dumps(run(args.db, args.threads, args.seconds, SCENARIOS[args.scenario], url=args.url), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Microbenchmarks for the flex calculations and the diary report aggregation,
+run against a database produced by benchmarks.generate.
+
+    python -m benchmarks.micro --db bench.db
+"""
+import argparse
+import json
+import statistics
+import time
+
+import app as time_manager
+
+
+def _timeit(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {"min_ms": min(timings) * 1000, "median_ms": statistics.median(timings) * 1000, "runs": repeat}
+
+
+def run(db_path, repeat=5):
+    time_manager.app.config["DATABASE"] = db_path
+    results = {}
+    with time_manager.db_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT user_id FROM time_logs GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        user_id = c.fetchone()[0]
+        c.execute("SELECT id, date, check_in, check_out, flex_time, user_id FROM time_logs")
+        all_logs = c.fetchall()
+        c.execute("SELECT id, date, check_in, check_out, flex_time, user_id FROM time_logs WHERE user_id=?",
+                  (user_id,))
+        user_logs = c.fetchall()
+
+        results["calculate_daily_and_weekly_flex_user"] = dict(
+            _timeit(lambda: time_manager.calculate_daily_and_weekly_flex(user_logs), repeat), rows=len(user_logs))
+        results["calculate_daily_and_weekly_flex_all"] = dict(
+            _timeit(lambda: time_manager.calculate_daily_and_weekly_flex(all_logs), repeat), rows=len(all_logs))
+
+        def flex_per_session():
+            for log in all_logs:
+                time_manager.calculate_flex_time(log[1], log[2], None, None, log[3])
+        results["calculate_flex_time"] = dict(_timeit(flex_per_session, repeat), rows=len(all_logs))
+
+        results["diary_report_aggregation"] = dict(
+            _timeit(lambda: time_manager.build_diary_report(c, user_id), repeat), user_id=user_id)
+    time_manager.close_pool()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.db, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+gunicorn settings for serving Time Manager in production:
+
+    TIME_MANAGER_SECRET_KEY=... gunicorn -c gunicorn.conf.py wsgi:app
+
+Workers and bind address follow gunicorn's usual WEB_CONCURRENCY and PORT variables;
+anything else can be overridden on the command line or with GUNICORN_CMD_ARGS.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# Threads keep a worker serving check-ins while another request waits on SQLite.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+# Import the app in the master, so create_app() (schema setup, migrations, job recovery)
+# runs once instead of racing in every worker.
+preload_app = True
+timeout = 60
+graceful_timeout = 30
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # create_app() already closed the master's connections; this guards against anything
+    # opened since, because SQLite connections must not be shared across a fork.
+    from app import close_pool
+    close_pool()
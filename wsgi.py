@@ -0,0 +1,11 @@
+"""
+WSGI entry point for production servers:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    waitress-serve --listen=0.0.0.0:8000 --threads=8 wsgi:app
+
+Configuration comes from TIME_MANAGER_* environment variables (see create_app).
+"""
+from app import create_app
+
+app = application = create_app()